@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from cards.models import Truck, Norm, Card, Departure
+from cards.models import Truck, Norm, Card, Departure, CardTotal, ReportJob
 
 
 @admin.register(Truck)
@@ -36,3 +36,17 @@ class DepartureAdmin(admin.ModelAdmin):
         'user',
         'norm',
     ]
+
+
+@admin.register(CardTotal)
+class CardTotalAdmin(admin.ModelAdmin):
+    readonly_fields = ['card', 'total_distance', 'total_mileage_consumption',
+                       'total_time_with_pump', 'total_with_pump_consumption',
+                       'total_time_without_pump', 'total_without_pump_consumption',
+                       'total_refueled']
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'subject', 'email', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status']
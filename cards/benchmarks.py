@@ -0,0 +1,122 @@
+import datetime
+import random
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from cards import ledger
+from cards.models import Truck, Norm, Card, Departure
+from cards.reports import ReportCache
+
+# допустимое число запросов на страницу, включая сессию и пользователя;
+# не должно зависеть от размера автопарка и числа выездов
+PDF_VIEWS = {'short_report', 'full_report'}
+
+QUERY_BUDGETS = {
+    'card_list': 4,
+    'card_detail': 6,
+    'departure_detail': 3,
+    'departure_add': 3,
+    'report_detail': 3,
+    'short_report': 4,
+    'full_report': 4,
+}
+
+
+def seed_fleet(trucks: int = 2, months: int = 2, departures: int = 30, seed: int = 0) -> dict:
+    # синтетический автопарк: trucks x months карточек, по departures выездов в каждой
+    rnd = random.Random(seed)
+    user = get_user_model().objects.create_user(username='bench', password='bench', is_superuser=True)
+    norm = Norm.objects.create(season='бенчмарк', liter_per_km=Decimal('0.456'),
+                               work_with_pump_liter_per_min=Decimal('0.311'),
+                               work_without_pump_liter_per_min=Decimal('0.123'))
+    cards = list()
+    for t in range(trucks):
+        truck = Truck.objects.create(name=f'Урал{t}', full_name='Урал 5557', number=f'{t:04}')
+        for m in range(months):
+            month = datetime.date(2000 + m // 12, m % 12 + 1, 1)
+            cards.append(Card.objects.create(month=month, mileage=1000, remaining_fuel=Decimal(300),
+                                             truck=truck, norm=norm))
+
+    for card in cards:
+        batch = list()
+        # выезды по 4 в день с 06:00, по часу каждый
+        for i in range(departures):
+            day = card.month + datetime.timedelta(days=i // 4)
+            batch.append(Departure(date=day, departure_time=datetime.time(6 + i % 4 * 2),
+                                   return_time=datetime.time(7 + i % 4 * 2), place_of_work='бенчмарк',
+                                   distance=rnd.randint(0, 30), with_pump=rnd.choice([None, 10, 30]),
+                                   without_pump=rnd.randint(5, 40), refueled=rnd.choice([None, None, 100]),
+                                   card=card, user=user, norm=norm))
+        # bulk_create не вызывает сигналы, итоги считаются отдельно
+        Departure.objects.bulk_create(batch, batch_size=1000)
+        ledger.rebuild_card(card)
+
+    card = cards[-1]
+    return {
+        'user': user,
+        'card': card,
+        'departure': card.departures.order_by('date', 'departure_time').last(),
+        'departures_total': len(cards) * departures,
+    }
+
+
+def view_urls(fleet: dict) -> dict:
+    card, departure = fleet['card'], fleet['departure']
+    return {
+        'card_list': reverse('card_list'),
+        'card_detail': reverse('card_detail', kwargs={'pk': card.pk}),
+        'departure_detail': reverse('departure_detail', kwargs={'pk': departure.pk}),
+        'departure_add': reverse('departure_add', kwargs={'pk': card.pk}),
+        'report_detail': reverse('report_detail', kwargs={'pk': card.pk}),
+        'short_report': reverse('short_report', kwargs={'pk': card.pk}),
+        'full_report': reverse('full_report', kwargs={'pk': card.pk}),
+    }
+
+
+def measure(client: Client, url: str, repeat: int = 3, before=None) -> dict:
+    # первый запрос отдельно не учитывается: прогрев шаблонов и кешей процесса
+    client.get(url)
+    timings = list()
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            if before:
+                before()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - started)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'time_ms': round(min(timings) * 1000, 2),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(fleet: dict, views=None, repeat: int = 3) -> list:
+    client = Client()
+    client.force_login(fleet['user'])
+    results = list()
+    # pdf меряются без кеша отчетов: перед каждым запросом временный кеш очищается
+    with tempfile.TemporaryDirectory() as cache_dir, override_settings(REPORT_CACHE_DIR=cache_dir):
+        for name, url in view_urls(fleet).items():
+            if views and name not in views:
+                continue
+            result = measure(client, url, repeat, ReportCache().clear if name in PDF_VIEWS else None)
+            result['view'] = name
+            result['budget'] = QUERY_BUDGETS[name]
+            result['over_budget'] = result['queries'] > QUERY_BUDGETS[name]
+            results.append(result)
+    return results
@@ -0,0 +1,119 @@
+from decimal import Decimal
+from itertools import accumulate, repeat
+from operator import mul
+
+from cards import references
+
+ZERO = Decimal(0)
+
+# поля выезда, которых достаточно для расчета (values_list без создания моделей)
+DEPARTURE_FIELDS = ('pk', 'norm_id', 'distance', 'with_pump', 'without_pump', 'refueled')
+
+
+class Rates:
+    # нормы расхода: л/км, л/мин с насосом, л/мин без насоса
+    __slots__ = ('per_km', 'with_pump', 'without_pump')
+
+    def __init__(self, per_km, with_pump, without_pump):
+        self.per_km = per_km
+        self.with_pump = with_pump
+        self.without_pump = without_pump
+
+    @classmethod
+    def from_norm(cls, norm):
+        return cls(norm.liter_per_km, norm.work_with_pump_liter_per_min, norm.work_without_pump_liter_per_min)
+
+
+class Fuel:
+    # расход одного выезда и нарастающие итоги по карточке с учетом этого выезда
+    __slots__ = ('pk', 'distance', 'with_pump', 'without_pump', 'refueled',
+                 'mileage_consumption', 'with_pump_consumption', 'without_pump_consumption',
+                 'cumulative_distance', 'cumulative_consumption', 'cumulative_refueled')
+
+    @property
+    def consumption(self):
+        return self.mileage_consumption + self.with_pump_consumption + self.without_pump_consumption
+
+
+def rates_for(norm_id) -> Rates:
+    return Rates.from_norm(references.norms.get(norm_id))
+
+
+def evaluate(distance, with_pump, without_pump, refueled, rates: Rates, pk=None) -> Fuel:
+    fuel = Fuel()
+    fuel.pk = pk
+    fuel.distance = distance or 0
+    fuel.with_pump = with_pump or 0
+    fuel.without_pump = without_pump or 0
+    fuel.refueled = refueled or 0
+    fuel.mileage_consumption = fuel.distance * rates.per_km
+    fuel.with_pump_consumption = fuel.with_pump * rates.with_pump
+    fuel.without_pump_consumption = fuel.without_pump * rates.without_pump
+    fuel.cumulative_distance = fuel.distance
+    fuel.cumulative_consumption = fuel.consumption
+    fuel.cumulative_refueled = fuel.refueled
+    return fuel
+
+
+def evaluate_departure(departure, rates: Rates = None) -> Fuel:
+    if rates is None:
+        rates = Rates.from_norm(references.departure_norm(departure))
+    return evaluate(departure.distance, departure.with_pump, departure.without_pump, departure.refueled,
+                    rates, departure.pk)
+
+
+def evaluate_batch(rows, rates=rates_for) -> list:
+    # rows - кортежи DEPARTURE_FIELDS в порядке выездов карточки (date, departure_time, id);
+    # расход считается по столбцам (умножение столбца на норму), итоги - накоплением по столбцу
+    rows = list(rows)
+    if not rows:
+        return []
+    pks, norm_ids, distances, with_pumps, without_pumps, refueled = zip(*rows)
+    distances = [value or 0 for value in distances]
+    with_pumps = [value or 0 for value in with_pumps]
+    without_pumps = [value or 0 for value in without_pumps]
+    refueled = [value or 0 for value in refueled]
+
+    norm_rates = {norm_id: rates(norm_id) for norm_id in set(norm_ids)}
+    if len(norm_rates) == 1:
+        (rate,) = norm_rates.values()
+        per_km, with_pump, without_pump = repeat(rate.per_km), repeat(rate.with_pump), repeat(rate.without_pump)
+    else:
+        per_km = [norm_rates[norm_id].per_km for norm_id in norm_ids]
+        with_pump = [norm_rates[norm_id].with_pump for norm_id in norm_ids]
+        without_pump = [norm_rates[norm_id].without_pump for norm_id in norm_ids]
+
+    mileage = list(map(mul, distances, per_km))
+    with_pump_consumption = list(map(mul, with_pumps, with_pump))
+    without_pump_consumption = list(map(mul, without_pumps, without_pump))
+    consumption = list(map(sum, zip(mileage, with_pump_consumption, without_pump_consumption)))
+
+    results = list()
+    for values in zip(pks, distances, with_pumps, without_pumps, refueled,
+                      mileage, with_pump_consumption, without_pump_consumption,
+                      accumulate(distances), accumulate(consumption), accumulate(refueled)):
+        fuel = Fuel()
+        (fuel.pk, fuel.distance, fuel.with_pump, fuel.without_pump, fuel.refueled,
+         fuel.mileage_consumption, fuel.with_pump_consumption, fuel.without_pump_consumption,
+         fuel.cumulative_distance, fuel.cumulative_consumption, fuel.cumulative_refueled) = values
+        results.append(fuel)
+    return results
+
+
+def totals(results: list) -> dict:
+    # итоги карточки в полях CardTotal (см. cards.ledger.TOTAL_FIELDS)
+    return {
+        'total_distance': sum(fuel.distance for fuel in results),
+        'total_mileage_consumption': sum((fuel.mileage_consumption for fuel in results), ZERO),
+        'total_time_with_pump': sum(fuel.with_pump for fuel in results),
+        'total_with_pump_consumption': sum((fuel.with_pump_consumption for fuel in results), ZERO),
+        'total_time_without_pump': sum(fuel.without_pump for fuel in results),
+        'total_without_pump_consumption': sum((fuel.without_pump_consumption for fuel in results), ZERO),
+        'total_refueled': sum(fuel.refueled for fuel in results),
+    }
+
+
+def card_fuel(card, rates=rates_for) -> list:
+    # один запрос и один проход по выездам карточки
+    return evaluate_batch(card.departures.order_by('date', 'departure_time', 'id').values_list(*DEPARTURE_FIELDS),
+                          rates)
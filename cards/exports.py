@@ -0,0 +1,154 @@
+import csv
+import re
+import tempfile
+import zipfile
+from decimal import Decimal
+from itertools import chain
+from xml.sax.saxutils import escape
+
+from cards import ledger
+from cards.models import Card, Departure
+
+CHUNK_SIZE = 2000
+
+# export_* возвращают заголовок и поток строк с числами как есть, к формату файла их приводят
+# stream_csv и write_xlsx
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# символы, недопустимые в xml 1.0
+XML_ILLEGAL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class Echo:
+    # псевдо-файл для csv.writer: строка сразу отдается в ответ, ничего не накапливается
+    def write(self, value):
+        return value
+
+
+def number(value):
+    # excel с русской локалью ждет запятую в дробных числах
+    if value is None:
+        return ''
+    if isinstance(value, (Decimal, float)):
+        return str(value).replace('.', ',')
+    return value
+
+
+def stream_csv(header: list, rows):
+    writer = csv.writer(Echo(), delimiter=';')
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([number(value) for value in row])
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Лист1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>',
+}
+
+
+def xlsx_cell(value) -> str:
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(XML_ILLEGAL_RE.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def write_xlsx(header: list, rows):
+    # xlsx - zip-архив, его нельзя отдавать по мере формирования строк: лист пишется построчно
+    # во временный файл (память не растет), готовый файл отдается ответом
+    file = tempfile.TemporaryFile()
+    with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        b'<sheetData>')
+            for row in chain([header], rows):
+                sheet.write(('<row>' + ''.join(map(xlsx_cell, row)) + '</row>').encode())
+            sheet.write(b'</sheetData></worksheet>')
+    file.seek(0)
+    return file
+
+
+def export_departures(date_from, date_to, truck=None):
+    departures = Departure.objects.filter(date__range=(date_from, date_to)).order_by('date', 'departure_time', 'id')
+    if truck:
+        departures = departures.filter(card__truck=truck)
+
+    header = ['дата', 'время выезда', 'время возвращения', 'автомобиль', 'номер', 'место/цель выезда',
+              'пройдено (км)', 'с насосом (мин)', 'без насоса (мин)', 'заправлено (л)', 'расход (л)',
+              'спидометр после выезда']
+    rows = ([departure.date.isoformat(),
+             departure.departure_time.strftime('%H:%M'),
+             departure.return_time.strftime('%H:%M'),
+             departure.card.truck.name,
+             departure.card.truck.number,
+             departure.place_of_work,
+             departure.distance,
+             departure.with_pump,
+             departure.without_pump,
+             departure.refueled,
+             departure.fuel_consumption,
+             departure.card.mileage + departure.cumulative_distance]
+            for departure in departures.iterator(chunk_size=CHUNK_SIZE))
+    return header, rows
+
+
+def export_card_totals(date_from, date_to, truck=None):
+    # карточка месяца попадает в выгрузку, даже если период начинается с середины этого месяца
+    cards = Card.objects.filter(month__range=(date_from.replace(day=1), date_to)). \
+        select_related('total').order_by('month', 'truck__name', 'truck__number')
+    if truck:
+        cards = cards.filter(truck=truck)
+
+    header = ['месяц', 'автомобиль', 'номер', 'норма', 'спидометр на начало', 'спидометр на конец',
+              'остаток на начало (л)', 'заправлено (л)', 'расход (л)', 'остаток на конец (л)',
+              'пробег (км)', 'с насосом (мин)', 'без насоса (мин)']
+
+    def rows():
+        for card in cards.iterator(chunk_size=CHUNK_SIZE):
+            # итоги без строки CardTotal пересчитываются, как в карточке
+            totals = ledger.calculated_result(card)
+            yield [card.month.strftime('%m.%Y'),
+                   card.truck.name,
+                   card.truck.number,
+                   card.norm.season,
+                   card.mileage,
+                   totals['current_mileage'],
+                   card.remaining_fuel,
+                   totals['total_refueled'],
+                   totals['total_fuel_consumption'],
+                   totals['remaining_fuel'],
+                   totals['total_distance'],
+                   totals['total_time_with_pump'],
+                   totals['total_time_without_pump']]
+
+    return header, rows()
@@ -1,4 +1,4 @@
-from datetime import datetime, date
+from datetime import date
 
 from bootstrap_datepicker_plus.widgets import MonthPickerInput, DatePickerInput, TimePickerInput
 from django import forms
@@ -6,7 +6,9 @@ from django.core.exceptions import ValidationError
 from django.db.models import QuerySet
 from django.utils import dates
 
-from cards.models import Truck, Norm, Card, Departure
+from cards import references
+from cards.models import Norm, Card, Departure
+from cards.references import ReferenceChoiceField
 
 
 class CardAddForm(forms.ModelForm):
@@ -20,12 +22,12 @@ class CardAddForm(forms.ModelForm):
                                  widget=forms.NumberInput(attrs={'class': 'form-control'}))
     remaining_fuel = forms.DecimalField(label='остаток топлива на 1 число месяца:',
                                         widget=forms.NumberInput(attrs={'class': 'form-control'}))
-    truck = forms.ModelChoiceField(queryset=Truck.objects.all(),
-                                   label='автомобиль:',
-                                   widget=forms.Select(attrs={'class': 'form-control'}))
-    norm = forms.ModelChoiceField(queryset=Norm.objects.all(),
-                                  label='норма расхода топлива:',
-                                  widget=forms.Select(attrs={'class': 'form-control'}))
+    truck = ReferenceChoiceField(references.trucks,
+                                 label='автомобиль:',
+                                 widget=forms.Select(attrs={'class': 'form-control'}))
+    norm = ReferenceChoiceField(references.norms,
+                                label='норма расхода топлива:',
+                                widget=forms.Select(attrs={'class': 'form-control'}))
 
     class Meta:
         model = Card
@@ -37,15 +39,9 @@ class CardAddForm(forms.ModelForm):
         truck = cd.get('truck')
 
         # исключает перезапись карточки
-        if self.update:
-            if Card.objects.filter(month__month=month.month, truck=truck).exists() \
-                    and self.instance.month.month != month.month \
-                    or Card.objects.filter(month__month=month.month, truck=truck).exists() \
-                    and self.instance.truck != truck:
-                raise ValidationError('Такая карточка уже существует')
-        else:
-            if Card.objects.filter(month__month=month.month, truck=truck).exists():
-                raise ValidationError('Такая карточка уже существует')
+        if month and truck and Card.objects.for_month(month.year, month.month).filter(truck=truck). \
+                exclude(pk=self.instance.pk).exists():
+            raise ValidationError('Такая карточка уже существует')
 
 
 class DepartureAddForm(forms.ModelForm):
@@ -58,6 +54,7 @@ class DepartureAddForm(forms.ModelForm):
     date = forms.DateField(
         label='Дата выезда',
         widget=DatePickerInput(attrs={'class': 'form-control'}))
+    norm = ReferenceChoiceField(references.norms, widget=forms.HiddenInput())
     current_mileage = forms.IntegerField(
         required=False,
         label='Тек. спидометр (км)',
@@ -84,29 +81,27 @@ class DepartureAddForm(forms.ModelForm):
             'refueled': forms.NumberInput(attrs={'class': 'form-control'}),
             'card': forms.HiddenInput(),
             'user': forms.HiddenInput(),
-            'norm': forms.HiddenInput()
         }
 
-    def clean(self):
-        cd: dict = super().clean()
-
+    def check_overlap(self):
+        # отслеживает, чтобы не было пересекающихся по времени выездов (выезд может идти через полночь);
+        # вызывается из clean и повторно при сохранении, под блокировкой карточки (cards.locking)
+        cd = self.cleaned_data
+        departures: QuerySet = self.initial['card'].departures.all()
         if self.update and self.departure:
-            departures: QuerySet = self.initial['card'].departures.exclude(id=self.departure.id)
-        else:
-            departures: QuerySet = self.initial['card'].departures.all()
-
-        # отслеживает, чтобы не было пересекающихся по времени выездов
-        cur_departure_time = datetime.combine(cd.get('date'), cd.get('departure_time'))
-        cur_return_time = datetime.combine(cd.get('date'), cd.get('return_time'))
-        for departure in departures:
-
-            departure_time = datetime.combine(departure.date, departure.departure_time)
-            return_time = datetime.combine(departure.date, departure.return_time)
-            if departure_time < cur_departure_time < return_time or \
-                    departure_time < cur_return_time < return_time or \
-                    cur_departure_time <= departure_time and cur_return_time >= return_time:
+            departures = departures.exclude(id=self.departure.id)
+
+        departure_date, departure_time, return_time = cd.get('date'), cd.get('departure_time'), cd.get('return_time')
+        if departure_date and departure_time and return_time:
+            departure_time, return_time = departure_time.replace(second=0), return_time.replace(second=0)
+            if departure_time == return_time or \
+                    departures.overlapping(departure_date, departure_time, return_time).exists():
                 raise ValidationError("В это время уже записан выезд или время выезда и возвращения одинаковы")
 
+    def clean(self):
+        cd: dict = super().clean()
+        self.check_overlap()
+
         if not cd.get('distance') \
                 and not cd.get('with_pump') \
                 and not cd.get('without_pump'):
@@ -138,6 +133,70 @@ class ReportChoiceForm(forms.Form):
         widget=forms.EmailInput(attrs={'class': 'form-control'}))
 
 
+class BulkReportForm(forms.Form):
+    FORMATS = {'pdf': 'один pdf', 'zip': 'zip архив pdf по карточкам'}
+
+    year = forms.TypedChoiceField(
+        label='Год',
+        coerce=int,
+        choices=YEARS,
+        widget=forms.Select(attrs={'class': 'form-control'}))
+    month = forms.TypedChoiceField(
+        label='Месяц',
+        coerce=int,
+        required=False,
+        empty_value=None,
+        choices=[('', 'весь год')] + list(dates.MONTHS.items()),
+        widget=forms.Select(attrs={'class': 'form-control'}))
+    truck = ReferenceChoiceField(
+        references.trucks,
+        label='Автомобиль',
+        required=False,
+        empty_label='все автомобили',
+        widget=forms.Select(attrs={'class': 'form-control'}))
+    template = forms.ChoiceField(
+        label='Отчет',
+        choices={'cards/short_report_pdf.html': 'короткий', 'cards/full_report_pdf.html': 'полный'},
+        widget=forms.Select(attrs={'class': 'form-control'}))
+    format = forms.ChoiceField(
+        label='Формат',
+        choices=FORMATS,
+        widget=forms.Select(attrs={'class': 'form-control'}))
+
+    def clean(self):
+        cd = super().clean()
+        # полный отчет рассчитан на одну карточку, в один pdf объединяются только короткие
+        if cd.get('format') == 'pdf' and cd.get('template') == 'cards/full_report_pdf.html':
+            self.add_error('template', 'полные отчеты выгружаются только zip архивом')
+        return cd
+
+
+class ExportForm(forms.Form):
+    date_from = forms.DateField(
+        label='С',
+        widget=DatePickerInput(attrs={'class': 'form-control'}))
+    date_to = forms.DateField(
+        label='По',
+        widget=DatePickerInput(attrs={'class': 'form-control'}))
+    truck = ReferenceChoiceField(
+        references.trucks,
+        label='Автомобиль',
+        required=False,
+        empty_label='все автомобили',
+        widget=forms.Select(attrs={'class': 'form-control'}))
+    file_format = forms.ChoiceField(
+        label='Формат',
+        choices=[('csv', 'csv'), ('xlsx', 'xlsx (excel)')],
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'}))
+
+    def clean(self):
+        cd = super().clean()
+        if cd.get('date_from') and cd.get('date_to') and cd['date_from'] > cd['date_to']:
+            raise ValidationError('Начало периода позже конца')
+        return cd
+
+
 class NormAddForm(forms.ModelForm):
     season = forms.CharField(label='марка авто и сезон',
                              widget=forms.TextInput(attrs={'class': 'form-control'}))
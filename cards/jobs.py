@@ -0,0 +1,92 @@
+import logging
+from datetime import timedelta
+
+from django.core.mail import EmailMessage
+from django.db.models import F
+from django.utils import timezone
+
+from cards.models import Card, ReportJob
+from cards.reports import get_report_pdf
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+# задача в статусе RUNNING дольше LEASE_TIMEOUT считается брошенной (обработчик упал или перезапущен)
+LEASE_TIMEOUT = timedelta(minutes=15)
+# пауза перед повтором: RETRY_DELAY, 2 * RETRY_DELAY, ...
+RETRY_DELAY = timedelta(minutes=1)
+
+
+def enqueue_report_email(template: str, cards: list, email: str, user=None) -> ReportJob:
+    if len(cards) == 1:
+        card = cards[0]
+        subject = f'Отчет {card}'
+        filename = f"отчет-{card.truck.name}-{card.month.month}-{card.month.year}.pdf"
+    else:
+        subject = f'Отчет {cards[0].truck.name} и {cards[1]}'
+        filename = f"отчет-{cards[0].truck.name}-{cards[1].truck.name}-{cards[0].month.month}-{cards[0].month.year}.pdf"
+    return ReportJob.objects.create(template=template, card_ids=[card.pk for card in cards], email=email,
+                                    subject=subject, filename=filename, user=user)
+
+
+def requeue_expired_jobs() -> int:
+    # брошенные задачи возвращаются в очередь, исчерпавшие попытки - в FAILED
+    now = timezone.now()
+    expired = ReportJob.objects.filter(status=ReportJob.Status.RUNNING, started_at__lt=now - LEASE_TIMEOUT)
+    failed = expired.filter(attempts__gte=MAX_ATTEMPTS). \
+        update(status=ReportJob.Status.FAILED, error='Обработчик не завершил задачу', finished_at=now)
+    requeued = expired.update(status=ReportJob.Status.PENDING, run_after=now)
+    if failed or requeued:
+        logger.warning('Брошенные задачи: возвращено в очередь %s, завершено с ошибкой %s', requeued, failed)
+    return requeued
+
+
+def claim_next_job():
+    # забирает задачу из очереди; несколько обработчиков не возьмут одну задачу дважды
+    requeue_expired_jobs()
+    now = timezone.now()
+    for job in ReportJob.objects.filter(status=ReportJob.Status.PENDING, run_after__lte=now)[:10]:
+        claimed = ReportJob.objects.filter(pk=job.pk, status=ReportJob.Status.PENDING). \
+            update(status=ReportJob.Status.RUNNING, attempts=F('attempts') + 1, started_at=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job: ReportJob) -> None:
+    try:
+        cards = list(Card.objects.filter(pk__in=job.card_ids).select_related('total'))
+        cards.sort(key=lambda card: job.card_ids.index(card.pk))
+        pdf = get_report_pdf(job.template, cards)
+        email = EmailMessage(
+            subject=job.subject,
+            body='Отчет находится в прикрепленном файле',
+            from_email='zvovan77@yandex.ru',
+            to=[job.email]
+        )
+        email.attach(job.filename, pdf)
+        email.send()
+    except Exception as e:
+        logger.exception('Не удалось отправить отчет, задача %s', job.pk)
+        job.error = str(e)
+        job.status = ReportJob.Status.PENDING if job.attempts < MAX_ATTEMPTS else ReportJob.Status.FAILED
+    else:
+        job.error = ''
+        job.status = ReportJob.Status.DONE
+    if job.status == ReportJob.Status.PENDING:
+        job.run_after = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+    else:
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'run_after', 'finished_at'])
+
+
+def run_pending(limit: int = None) -> int:
+    done = 0
+    while limit is None or done < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        done += 1
+    return done
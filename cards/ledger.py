@@ -0,0 +1,160 @@
+from decimal import Decimal
+
+from django.db.models import F, Q, Sum
+
+from cards import consumption
+from cards.models import Card, CardTotal, Departure, Norm
+
+TOTAL_FIELDS = [
+    'total_distance',
+    'total_mileage_consumption',
+    'total_time_with_pump',
+    'total_with_pump_consumption',
+    'total_time_without_pump',
+    'total_without_pump_consumption',
+    'total_refueled',
+]
+
+
+# итоги пишутся по нормам, прочитанным из базы в транзакции записи (под блокировкой карточки):
+# справочник cards.references в памяти другого процесса может отставать до REFERENCE_CACHE_TTL,
+# и расход по старой норме остался бы в CardTotal и нарастающих итогах
+
+
+def card_rates(card: Card):
+    # нормы всех выездов карточки одним запросом, для consumption.evaluate_batch
+    rates = {norm.pk: consumption.Rates.from_norm(norm)
+             for norm in Norm.objects.filter(departures__card=card).distinct()}
+    return rates.__getitem__
+
+
+def departures_fuel(*departures: Departure) -> list:
+    # расход выездов (старого и нового вида при изменении) по нормам из базы, один запрос на все нормы;
+    # результат передается в apply_departure/shift_following/place_departure
+    norms = Norm.objects.in_bulk({departure.norm_id for departure in departures})
+    return [consumption.evaluate_departure(departure, consumption.Rates.from_norm(norms[departure.norm_id]))
+            for departure in departures]
+
+
+def apply_departure(departure: Departure, fuel: consumption.Fuel, sign: int = 1) -> None:
+    # sign=1 - добавить выезд в итоги, sign=-1 - убрать
+    contribution = consumption.totals([fuel])
+    CardTotal.objects.filter(card_id=departure.card_id).update(
+        **{field: F(field) + sign * value for field, value in contribution.items()})
+
+
+def departure_position(departure: Departure) -> Q:
+    # выезды карточки, идущие после данного в порядке (date, departure_time, id): выезд через полночь
+    # стоит в дне, когда он начался
+    return Q(date__gt=departure.date) | \
+        Q(date=departure.date, departure_time__gt=departure.departure_time) | \
+        Q(date=departure.date, departure_time=departure.departure_time, id__gt=departure.pk)
+
+
+def shift_following(departure: Departure, fuel: consumption.Fuel, sign: int = 1) -> None:
+    # сдвигает нарастающие итоги всех выездов после данного на его вклад
+    Departure.objects.filter(departure_position(departure), card_id=departure.card_id). \
+        exclude(pk=departure.pk). \
+        update(cumulative_distance=F('cumulative_distance') + sign * fuel.distance,
+               cumulative_consumption=F('cumulative_consumption') + sign * fuel.consumption,
+               cumulative_refueled=F('cumulative_refueled') + sign * fuel.refueled)
+
+
+def place_departure(departure: Departure, fuel: consumption.Fuel) -> None:
+    # нарастающий итог выезда = итог предыдущего выезда + собственный вклад
+    previous = Departure.objects.filter(card_id=departure.card_id). \
+        exclude(departure_position(departure)).exclude(pk=departure.pk). \
+        order_by('-date', '-departure_time', '-id'). \
+        values('cumulative_distance', 'cumulative_consumption', 'cumulative_refueled').first()
+    if previous is None:
+        previous = {'cumulative_distance': 0, 'cumulative_consumption': 0, 'cumulative_refueled': 0}
+    departure.cumulative_distance = previous['cumulative_distance'] + (departure.distance or 0)
+    departure.cumulative_consumption = previous['cumulative_consumption'] + fuel.consumption
+    departure.cumulative_refueled = previous['cumulative_refueled'] + (departure.refueled or 0)
+    Departure.objects.filter(pk=departure.pk).update(cumulative_distance=departure.cumulative_distance,
+                                                     cumulative_consumption=departure.cumulative_consumption,
+                                                     cumulative_refueled=departure.cumulative_refueled)
+
+
+def rebuild_cumulative(card: Card, results: list = None) -> None:
+    # results - готовый расчет consumption.card_fuel, чтобы не проходить выезды повторно
+    if results is None:
+        results = consumption.card_fuel(card, card_rates(card))
+    departures = [Departure(pk=fuel.pk, cumulative_distance=fuel.cumulative_distance,
+                            cumulative_consumption=fuel.cumulative_consumption,
+                            cumulative_refueled=fuel.cumulative_refueled) for fuel in results]
+    Departure.objects.bulk_update(departures,
+                                  ['cumulative_distance', 'cumulative_consumption', 'cumulative_refueled'],
+                                  batch_size=500)
+
+
+def verify_cumulative(card: Card) -> list:
+    # возвращает id выездов с неверными нарастающими итогами
+    rows = list(card.departures.order_by('date', 'departure_time', 'id').values_list(
+        *consumption.DEPARTURE_FIELDS, 'cumulative_distance', 'cumulative_consumption', 'cumulative_refueled'))
+    results = consumption.evaluate_batch((row[:len(consumption.DEPARTURE_FIELDS)] for row in rows),
+                                         card_rates(card))
+    wrong = list()
+    for row, fuel in zip(rows, results):
+        distance, stored_consumption, refueled = row[len(consumption.DEPARTURE_FIELDS):]
+        if (distance, refueled) != (fuel.cumulative_distance, fuel.cumulative_refueled) \
+                or stored_consumption != Decimal(fuel.cumulative_consumption).quantize(Decimal('0.001')):
+            wrong.append(fuel.pk)
+    return wrong
+
+
+def aggregate_card_totals(card: Card) -> dict:
+    # итоги агрегирующим запросом в базе, независимая от consumption сверка (verify_card_total)
+    return card.departures. \
+        annotate(mileage_consumption=F('distance') * F('norm__liter_per_km'),
+                 with_pump_consumption=F('with_pump') * F('norm__work_with_pump_liter_per_min'),
+                 without_pump_consumption=F('without_pump') * F('norm__work_without_pump_liter_per_min')). \
+        aggregate(
+            total_distance=Sum('distance', default=0),
+            total_mileage_consumption=Sum('mileage_consumption', default=Decimal(0)),
+            total_time_with_pump=Sum('with_pump', default=0),
+            total_with_pump_consumption=Sum('with_pump_consumption', default=Decimal(0)),
+            total_time_without_pump=Sum('without_pump', default=0),
+            total_without_pump_consumption=Sum('without_pump_consumption', default=Decimal(0)),
+            total_refueled=Sum('refueled', default=0))
+
+
+def rebuild_card_total(card: Card, results: list = None) -> CardTotal:
+    if results is None:
+        results = consumption.card_fuel(card, card_rates(card))
+    total, _ = CardTotal.objects.update_or_create(card=card, defaults=consumption.totals(results))
+    return total
+
+
+def rebuild_card(card: Card) -> CardTotal:
+    # итоги карточки и нарастающие итоги выездов за один проход по выездам
+    results = consumption.card_fuel(card, card_rates(card))
+    rebuild_cumulative(card, results)
+    return rebuild_card_total(card, results)
+
+
+def verify_card_total(card: Card) -> dict:
+    # возвращает расхождения {поле: (сохранено, пересчитано)}
+    expected = aggregate_card_totals(card)
+    total = CardTotal.objects.filter(card=card).first()
+    if total is None:
+        return {field: (None, expected[field]) for field in TOTAL_FIELDS}
+    diff = dict()
+    for field in TOTAL_FIELDS:
+        stored = getattr(total, field)
+        if Decimal(stored).quantize(Decimal('0.001')) != Decimal(expected[field]).quantize(Decimal('0.001')):
+            diff[field] = (stored, expected[field])
+    return diff
+
+
+def get_card_total(card: Card) -> CardTotal:
+    try:
+        total = card.total
+    except CardTotal.DoesNotExist:
+        total = rebuild_card_total(card)
+    total.card = card
+    return total
+
+
+def calculated_result(card: Card) -> dict:
+    return get_card_total(card).as_dict()
@@ -0,0 +1,96 @@
+import datetime
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from cards import ledger
+from cards.models import Truck, Norm, Card
+
+SLOTS_PER_DAY = 10
+
+
+def slot_data(card: Card, user, slot: int) -> dict:
+    # слот - час выезда: 10 в день через 2 часа с 00:00
+    day = card.month + datetime.timedelta(days=slot // SLOTS_PER_DAY)
+    hour = slot % SLOTS_PER_DAY * 2
+    return {
+        'date': day.isoformat(),
+        'departure_time': f'{hour:02}:00',
+        'return_time': f'{hour + 1:02}:00',
+        'place_of_work': f'нагрузка {slot}',
+        'distance': slot % 7 + 1,
+        'without_pump': 10,
+        'refueled': 50 if slot % 5 == 0 else '',
+        'card': card.pk,
+        'user': user.pk,
+        'norm': card.norm_id,
+    }
+
+
+def seed_card() -> dict:
+    user = get_user_model().objects.create_user(username='load', password='load')
+    norm = Norm.objects.create(season='нагрузка', liter_per_km=Decimal('0.456'),
+                               work_with_pump_liter_per_min=Decimal('0.311'),
+                               work_without_pump_liter_per_min=Decimal('0.123'))
+    truck = Truck.objects.create(name='Урал', full_name='Урал 5557', number='0000')
+    card = Card.objects.create(month=datetime.date(2000, 1, 1), mileage=0, remaining_fuel=Decimal(0),
+                               truck=truck, norm=norm)
+    return {'user': user, 'card': card}
+
+
+def run_writers(card: Card, user, writers: int = 4, slots: int = 20, seed: int = 0) -> dict:
+    # writers потоков добавляют выезды в одну карточку через DepartureAdd, каждый пытается занять
+    # все slots слотов в своем порядке: каждый слот должен достаться ровно одному потоку
+    url = reverse('departure_add', kwargs={'pk': card.pk})
+    results = Counter()
+    lock = threading.Lock()
+    start = threading.Barrier(writers)
+
+    def writer(number: int):
+        client = Client()
+        client.force_login(user)
+        order = list(range(slots))
+        random.Random(seed + number).shuffle(order)
+        start.wait()
+        try:
+            for slot in order:
+                try:
+                    response = client.post(url, slot_data(card, user, slot))
+                    outcome = 'created' if response.status_code == 302 else 'rejected'
+                except Exception:
+                    outcome = 'errors'
+                with lock:
+                    results[outcome] += 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=writer, args=(number,)) for number in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    departures = card.departures.count()
+    return {
+        'writers': writers,
+        'slots': slots,
+        'requests': writers * slots,
+        'created': results['created'],
+        'rejected': results['rejected'],
+        'errors': results['errors'],
+        'departures': departures,
+        'lost_updates': results['created'] - departures,
+        'totals_diff': ledger.verify_card_total(card),
+        'wrong_cumulative': ledger.verify_cumulative(card),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(writers * slots / elapsed, 1),
+    }
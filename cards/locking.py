@@ -0,0 +1,46 @@
+import logging
+import random
+import time
+
+from django.db import transaction, OperationalError
+
+from cards.models import Card
+
+logger = logging.getLogger(__name__)
+
+LOCK_ATTEMPTS = 5
+LOCK_BACKOFF = 0.05
+
+# deadlock_detected и serialization_failure в PostgreSQL
+RETRY_PGCODES = {'40P01', '40001'}
+
+
+def is_lock_conflict(error: OperationalError) -> bool:
+    cause = error.__cause__
+    return 'locked' in str(error) or getattr(cause, 'pgcode', None) in RETRY_PGCODES \
+        or getattr(getattr(cause, 'diag', None), 'sqlstate', None) in RETRY_PGCODES
+
+
+def lock_cards(*card_ids) -> None:
+    # в PostgreSQL блокируются строки карточек (в одном порядке, чтобы не было взаимных блокировок);
+    # sqlite select_for_update не поддерживает, там транзакция сама берет блокировку записи
+    # (transaction_mode IMMEDIATE в SQLITE_OPTIONS)
+    list(Card.objects.select_related(None).select_for_update().filter(pk__in=card_ids).order_by('pk').
+         values_list('pk', flat=True))
+
+
+def run_locked(card_ids, func, attempts: int = None):
+    # выполняет func в транзакции с заблокированными карточками; при конфликте блокировок
+    # транзакция откатывается и func повторяется с нарастающей паузой
+    card_ids = sorted(set(card_ids))
+    attempts = attempts or LOCK_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic():
+                lock_cards(*card_ids)
+                return func()
+        except OperationalError as e:
+            if attempt == attempts or not is_lock_conflict(e):
+                raise
+            logger.warning('Конфликт блокировок карточек %s, попытка %s: %s', card_ids, attempt, e)
+            time.sleep(LOCK_BACKOFF * 2 ** (attempt - 1) * (1 + random.random()))
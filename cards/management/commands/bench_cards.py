@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment, setup_databases, \
+    teardown_databases
+
+from cards.benchmarks import seed_fleet, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Замеряет число запросов, время и память страниц карточек на синтетическом автопарке ' \
+           '(во временной тестовой базе)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trucks', type=int, default=5)
+        parser.add_argument('--months', type=int, default=12)
+        parser.add_argument('--departures', type=int, default=100, help='выездов в каждой карточке')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--views', nargs='*', help='замерять только эти страницы')
+        parser.add_argument('--output', help='записать результаты в json файл')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            fleet = seed_fleet(options['trucks'], options['months'], options['departures'])
+            results = run_benchmarks(fleet, options['views'], options['repeat'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        for result in results:
+            line = f"{result['view']:<18} {result['status']} запросов: {result['queries']:>3} " \
+                   f"(лимит {result['budget']}) {result['time_ms']:>9} мс {result['peak_memory_kb']:>9} КБ"
+            self.stdout.write(self.style.ERROR(line) if result['over_budget'] else line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'fleet': {'trucks': options['trucks'], 'months': options['months'],
+                                     'departures_per_card': options['departures'],
+                                     'departures_total': fleet['departures_total']},
+                           'results': results}, f, ensure_ascii=False, indent=2)
+
+        over_budget = [result['view'] for result in results if result['over_budget']]
+        if over_budget:
+            raise CommandError(f'Превышен лимит запросов: {", ".join(over_budget)}')
@@ -0,0 +1,55 @@
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.utils import load_backend
+
+from cards.models import Card
+
+SOURCE_ALIAS = 'sqlite_source'
+
+# создаются миграциями в новой базе заново, в дамп не попадают
+EXCLUDE = ['contenttypes', 'auth.permission', 'sessions']
+
+
+def open_source_database(path: str) -> None:
+    # соединение только на время переноса, в settings.DATABASES не добавляется
+    settings_dict = connections.configure_settings(
+        {DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}})[DEFAULT_DB_ALIAS]
+    connections[SOURCE_ALIAS] = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, SOURCE_ALIAS)
+
+
+class Command(BaseCommand):
+    help = 'Переносит данные из файла sqlite в текущую базу (например, PostgreSQL из DB_ENGINE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='путь к файлу sqlite, например db/db.sqlite3')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='база, в которую переносятся данные')
+        parser.add_argument('--force', action='store_true', help='переносить, даже если в базе уже есть карточки')
+
+    def handle(self, *args, **options):
+        source, target = options['source'], options['database']
+        if not os.path.isfile(source):
+            raise CommandError(f'Нет файла {source}')
+
+        call_command('migrate', database=target, interactive=False, verbosity=0)
+        if Card.objects.using(target).exists() and not options['force']:
+            raise CommandError('В базе уже есть карточки, перенос остановлен (--force чтобы продолжить)')
+
+        open_source_database(source)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                fixture = os.path.join(tmp, 'data.json')
+                # первичные ключи сохраняются, ссылки на типы и права - по естественным ключам
+                call_command('dumpdata', database=SOURCE_ALIAS, exclude=EXCLUDE, natural_foreign=True,
+                             output=fixture, verbosity=0)
+                # итоги карточек и нарастающие итоги выездов переносятся как есть (сигналы при raw не считают)
+                call_command('loaddata', fixture, database=target, verbosity=0)
+        finally:
+            connections[SOURCE_ALIAS].close()
+            del connections[SOURCE_ALIAS]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено карточек: {Card.objects.using(target).count()}'))
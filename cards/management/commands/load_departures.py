@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment, setup_databases, \
+    teardown_databases
+
+from cards.loadtest import seed_card, run_writers
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест: несколько потоков одновременно добавляют выезды в одну карточку ' \
+           '(во временной тестовой базе)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--slots', type=int, default=50, help='слотов выездов, каждый пишут все потоки')
+
+    def handle(self, *args, **options):
+        database = settings.DATABASES['default']
+        with tempfile.TemporaryDirectory() as tmp:
+            if database['ENGINE'] == 'django.db.backends.sqlite3':
+                # потоки должны писать в файл, а не в общую память: так работают блокировки sqlite
+                database.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'load.sqlite3')
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                fleet = seed_card()
+                result = run_writers(fleet['card'], fleet['user'], options['writers'], options['slots'])
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+
+        for key, value in result.items():
+            self.stdout.write(f'{key:<20} {value}')
+
+        if result['created'] != options['slots'] or result['departures'] != options['slots'] \
+                or result['errors'] or result['totals_diff'] or result['wrong_cumulative']:
+            raise CommandError('Потеряны или задвоены выезды, или итоги карточки не сходятся')
+        self.stdout.write(self.style.SUCCESS('Все слоты записаны ровно по одному разу, итоги сходятся'))
@@ -0,0 +1,81 @@
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from cards.benchmarks import QUERY_BUDGETS
+from voditel.profiling import profile_log_files
+
+
+def percentile(values: list, p: int):
+    # ближайший ранг, values отсортирован
+    if not values:
+        return None
+    index = max(0, -(-len(values) * p // 100) - 1)
+    return values[index]
+
+
+def summarize(records) -> list:
+    by_view = defaultdict(list)
+    for record in records:
+        by_view[record.get('url_name') or record['path']].append(record)
+
+    summary = list()
+    for view, items in by_view.items():
+        times = sorted(item['total_ms'] for item in items)
+        queries = sorted(item['queries'] for item in items)
+        summary.append({
+            'view': view,
+            'count': len(items),
+            'p50': percentile(times, 50),
+            'p95': percentile(times, 95),
+            'p99': percentile(times, 99),
+            'queries_p95': percentile(queries, 95),
+            'budget': QUERY_BUDGETS.get(view),
+            'sql_ms': round(sum(item['sql_ms'] for item in items) / len(items), 2),
+            'template_ms': round(sum(item['template_ms'] for item in items) / len(items), 2),
+            'pdf_ms': round(sum(item['pdf_ms'] for item in items) / len(items), 2),
+            'n_plus_one': sum(1 for item in items if item['duplicates']),
+        })
+    return sorted(summary, key=lambda row: row['p95'], reverse=True)
+
+
+def read_records(files: list):
+    for name in files:
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+class Command(BaseCommand):
+    help = 'Сводка по журналу профилирования: p50/p95/p99 времени ответа по страницам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='журналы (по умолчанию PROFILING_LOG_FILE и его архивы)')
+        parser.add_argument('--view', nargs='*', help='только эти страницы (имена url)')
+        parser.add_argument('--json', action='store_true', help='вывести сводку в json')
+
+    def handle(self, *args, **options):
+        records = read_records(options['files'] or profile_log_files())
+        if options['view']:
+            records = (record for record in records if record.get('url_name') in options['view'])
+        summary = summarize(records)
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+            return
+        if not summary:
+            self.stdout.write('Нет записей')
+            return
+
+        self.stdout.write(f"{'страница':<24} {'n':>6} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} "
+                          f"{'запросов p95':>13} {'sql мс':>8} {'шаблон мс':>10} {'pdf мс':>8} {'N+1':>5}")
+        for row in summary:
+            over_budget = row['budget'] is not None and row['queries_p95'] > row['budget']
+            line = f"{row['view']:<24} {row['count']:>6} {row['p50']:>9} {row['p95']:>9} {row['p99']:>9} " \
+                   f"{row['queries_p95']:>13} {row['sql_ms']:>8} {row['template_ms']:>10} {row['pdf_ms']:>8} " \
+                   f"{row['n_plus_one']:>5}"
+            self.stdout.write(self.style.ERROR(line) if over_budget or row['n_plus_one'] else line)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cards import ledger
+from cards.models import Card
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги карточек и нарастающие итоги выездов (с --verify только проверяет)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('card_ids', nargs='*', type=int, help='id карточек, по умолчанию все')
+        parser.add_argument('--verify', action='store_true', help='только сверить итоги, ничего не менять')
+
+    def handle(self, *args, **options):
+        cards = Card.objects.all()
+        if options['card_ids']:
+            cards = cards.filter(pk__in=options['card_ids'])
+
+        mismatched = 0
+        for card in cards.iterator():
+            diff = ledger.verify_card_total(card)
+            for field, (stored, expected) in diff.items():
+                self.stdout.write(f'{card.pk} {card}: {field} = {stored}, должно быть {expected}')
+            wrong = ledger.verify_cumulative(card)
+            if wrong:
+                self.stdout.write(f'{card.pk} {card}: неверный нарастающий итог у выездов {wrong}')
+            if diff or wrong:
+                mismatched += 1
+            if not options['verify']:
+                ledger.rebuild_card(card)
+
+        if options['verify']:
+            if mismatched:
+                raise CommandError(f'Расхождения в итогах {mismatched} карточек')
+            self.stdout.write(self.style.SUCCESS('Итоги совпадают'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Итоги пересчитаны, исправлено карточек: {mismatched}'))
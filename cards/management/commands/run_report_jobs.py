@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cards import jobs
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь отправки отчетов на email'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='обработать очередь и выйти')
+        parser.add_argument('--sleep', type=float, default=2, help='пауза между опросами очереди (сек)')
+
+    def handle(self, *args, **options):
+        while True:
+            done = jobs.run_pending()
+            if done:
+                self.stdout.write(f'Обработано задач: {done}')
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
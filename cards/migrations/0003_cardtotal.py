@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def fill_card_totals(apps, schema_editor):
+    Card = apps.get_model('cards', 'Card')
+    CardTotal = apps.get_model('cards', 'CardTotal')
+    for card in Card.objects.all():
+        totals = card.departures. \
+            annotate(mileage_consumption=F('distance') * F('norm__liter_per_km'),
+                     with_pump_consumption=F('with_pump') * F('norm__work_with_pump_liter_per_min'),
+                     without_pump_consumption=F('without_pump') * F('norm__work_without_pump_liter_per_min')). \
+            aggregate(
+                total_distance=Sum('distance', default=0),
+                total_mileage_consumption=Sum('mileage_consumption', default=0),
+                total_time_with_pump=Sum('with_pump', default=0),
+                total_with_pump_consumption=Sum('with_pump_consumption', default=0),
+                total_time_without_pump=Sum('without_pump', default=0),
+                total_without_pump_consumption=Sum('without_pump_consumption', default=0),
+                total_refueled=Sum('refueled', default=0))
+        CardTotal.objects.create(card=card, **totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_distance', models.PositiveIntegerField(default=0, verbose_name='пройдено (км)')),
+                ('total_mileage_consumption', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='расход по пробегу (л)')),
+                ('total_time_with_pump', models.PositiveIntegerField(default=0, verbose_name='с насосом (мин)')),
+                ('total_with_pump_consumption', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='расход с насосом (л)')),
+                ('total_time_without_pump', models.PositiveIntegerField(default=0, verbose_name='без насоса (мин)')),
+                ('total_without_pump_consumption', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='расход без насоса (л)')),
+                ('total_refueled', models.PositiveIntegerField(default=0, verbose_name='заправлено (л)')),
+                ('card', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='total', to='cards.card', verbose_name='карточка')),
+            ],
+        ),
+        migrations.RunPython(fill_card_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+def fill_cumulative(apps, schema_editor):
+    Card = apps.get_model('cards', 'Card')
+    Departure = apps.get_model('cards', 'Departure')
+    for card in Card.objects.all():
+        departures = list(card.departures.select_related('norm').order_by('date', 'return_time', 'id'))
+        distance, consumption, refueled = 0, 0, 0
+        for departure in departures:
+            norm = departure.norm
+            distance += departure.distance or 0
+            consumption += (departure.distance or 0) * norm.liter_per_km + \
+                (departure.with_pump or 0) * norm.work_with_pump_liter_per_min + \
+                (departure.without_pump or 0) * norm.work_without_pump_liter_per_min
+            refueled += departure.refueled or 0
+            departure.cumulative_distance = distance
+            departure.cumulative_consumption = consumption
+            departure.cumulative_refueled = refueled
+        Departure.objects.bulk_update(departures,
+                                      ['cumulative_distance', 'cumulative_consumption', 'cumulative_refueled'],
+                                      batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0003_cardtotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='departure',
+            name='cumulative_consumption',
+            field=models.DecimalField(decimal_places=3, default=0, editable=False, max_digits=12, verbose_name='израсходовано с начала месяца (л)'),
+        ),
+        migrations.AddField(
+            model_name='departure',
+            name='cumulative_distance',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='пройдено с начала месяца (км)'),
+        ),
+        migrations.AddField(
+            model_name='departure',
+            name='cumulative_refueled',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='заправлено с начала месяца (л)'),
+        ),
+        migrations.RunPython(fill_cumulative, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0004_departure_cumulative'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['card', 'date', 'departure_time', 'return_time'], name='departure_interval_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0005_departure_interval_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='версия'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0006_card_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template', models.CharField(max_length=100, verbose_name='шаблон отчета')),
+                ('card_ids', models.JSONField(verbose_name='карточки')),
+                ('email', models.EmailField(max_length=254, verbose_name='email')),
+                ('subject', models.CharField(max_length=200, verbose_name='тема письма')),
+                ('filename', models.CharField(max_length=200, verbose_name='имя файла')),
+                ('status', models.CharField(choices=[('pending', 'в очереди'), ('running', 'выполняется'), ('done', 'отправлено'), ('failed', 'ошибка')], db_index=True, default='pending', max_length=10, verbose_name='статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='попыток')),
+                ('error', models.TextField(blank=True, verbose_name='ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='создано')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='завершено')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='report_jobs', to=settings.AUTH_USER_MODEL, verbose_name='пользователь')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:22
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import migrations, models
+
+
+def check_duplicate_cards(apps, schema_editor):
+    # карточки одного автомобиля за один месяц (например, с 1 и с 15 числа) не объединяются
+    # автоматически: у них свои пробег, остаток и выезды; миграция останавливается со списком
+    Card = apps.get_model('cards', 'Card')
+    months = defaultdict(list)
+    for card in Card.objects.select_related('truck').order_by('truck_id', 'month', 'pk'):
+        months[card.truck, card.month.year, card.month.month].append(card)
+    duplicates = [
+        f'  {truck.name} {truck.number}, {month:02}.{year}: '
+        + ', '.join(f'id={card.pk} ({card.month:%d.%m.%Y})' for card in cards)
+        for (truck, year, month), cards in months.items() if len(cards) > 1]
+    if duplicates:
+        raise CommandError('Несколько карточек одного автомобиля за месяц, объедините или удалите лишние '
+                           'и повторите migrate:\n' + '\n'.join(duplicates))
+
+
+def normalize_card_month(apps, schema_editor):
+    # до ограничения уникальности все карточки приводятся к 1 числу месяца
+    Card = apps.get_model('cards', 'Card')
+    for card in Card.objects.exclude(month__day=1):
+        card.month = card.month.replace(day=1)
+        card.save(update_fields=['month'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0007_reportjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['month'], name='card_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['card', 'date', 'return_time'], name='departure_card_order_idx'),
+        ),
+        migrations.RunPython(check_duplicate_cards, migrations.RunPython.noop),
+        migrations.RunPython(normalize_card_month, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='card',
+            constraint=models.UniqueConstraint(fields=('truck', 'month'), name='card_truck_month_unique'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def rebuild_overnight_cumulative(apps, schema_editor):
+    # нарастающие итоги меняются только в карточках с выездами через полночь: в порядке
+    # (date, return_time) такой выезд стоял раньше утренних выездов того же дня
+    Departure = apps.get_model('cards', 'Departure')
+    card_ids = Departure.objects.filter(return_time__lte=models.F('departure_time')). \
+        values_list('card_id', flat=True).order_by('card_id').distinct()
+    for card_id in card_ids:
+        distance = consumption = refueled = 0
+        departures = list(Departure.objects.filter(card_id=card_id).select_related('norm').
+                          order_by('date', 'departure_time', 'id'))
+        for departure in departures:
+            norm = departure.norm
+            distance += departure.distance or 0
+            consumption += (departure.distance or 0) * norm.liter_per_km + \
+                (departure.with_pump or 0) * norm.work_with_pump_liter_per_min + \
+                (departure.without_pump or 0) * norm.work_without_pump_liter_per_min
+            refueled += departure.refueled or 0
+            departure.cumulative_distance = distance
+            departure.cumulative_consumption = consumption
+            departure.cumulative_refueled = refueled
+        Departure.objects.bulk_update(departures,
+                                      ['cumulative_distance', 'cumulative_consumption', 'cumulative_refueled'],
+                                      batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0008_card_departure_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='departure',
+            options={'ordering': ['-date', '-departure_time']},
+        ),
+        # порядок (card, date, departure_time) обслуживает левый префикс departure_interval_idx
+        migrations.RemoveIndex(
+            model_name='departure',
+            name='departure_card_order_idx',
+        ),
+        migrations.RunPython(rebuild_overnight_cumulative, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def start_running_jobs(apps, schema_editor):
+    # задачи, выполнявшиеся до появления started_at, обработчик заберет как брошенные
+    ReportJob = apps.get_model('cards', 'ReportJob')
+    ReportJob.objects.filter(status='running').update(started_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0009_departure_order_by_departure_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='run_after',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='запустить после'),
+        ),
+        migrations.AddField(
+            model_name='reportjob',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='начато'),
+        ),
+        migrations.RunPython(start_running_jobs, migrations.RunPython.noop),
+    ]
@@ -4,6 +4,7 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.urls import reverse
 
+from cards import consumption
 from users.templatetags.common_filters import get_rus_month_year
 from django.utils import timezone
 
@@ -27,12 +28,33 @@ class Norm(models.Model):
         return f'{self.season}'
 
 
+class CardQuerySet(models.QuerySet):
+    # условия по диапазону дат, а не month__month/month__year: так работает индекс по month
+    def for_month(self, year: int, month: int):
+        start = datetime.date(year, month, 1)
+        end = datetime.date(year + month // 12, month % 12 + 1, 1)
+        return self.filter(month__gte=start, month__lt=end)
+
+    def for_year(self, year: int):
+        return self.filter(month__gte=datetime.date(year, 1, 1), month__lt=datetime.date(year + 1, 1, 1))
+
+
+class CardManager(models.Manager.from_queryset(CardQuerySet)):
+    # автомобиль и норма нужны почти везде, где показывается карточка (в том числе в __str__)
+    def get_queryset(self):
+        return super().get_queryset().select_related('truck', 'norm')
+
+
 class Card(models.Model):
     month = models.DateField(verbose_name="дата начала карты")
     mileage = models.PositiveIntegerField(verbose_name="пробег на 1 число месяца")
     remaining_fuel = models.DecimalField(max_digits=6, decimal_places=3, verbose_name="остаток топлива на 1 число месяца")
     truck = models.ForeignKey(Truck, related_name="cards", on_delete=models.CASCADE, verbose_name='автомобиль')
     norm = models.ForeignKey(Norm, related_name="cards", on_delete=models.CASCADE, verbose_name='норма расхода топлива')
+    # растет при любом изменении карточки, ее выездов, нормы или автомобиля (ключ кеша отчетов)
+    version = models.PositiveIntegerField(default=0, editable=False, verbose_name='версия')
+
+    objects = CardManager()
 
     def __str__(self):
         return f'{self.truck.name} - {get_rus_month_year(self.month)}'
@@ -40,8 +62,53 @@ class Card(models.Model):
     def get_absolute_url(self):
         return reverse('card_detail', kwargs={'pk': self.id})
 
+    def save(self, *args, **kwargs):
+        # карточка всегда начинается с 1 числа месяца (см. ограничение card_truck_month_unique)
+        self.month = self.month.replace(day=1)
+        if self._state.adding:
+            self.version += 1
+            return super().save(*args, **kwargs)
+        # версию могли поднять сигналы выездов, нормы или автомобиля после загрузки этого экземпляра:
+        # она не переписывается из памяти, а увеличивается в базе (F) и перечитывается
+        if kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'version']
+        else:
+            kwargs['update_fields'] = [name for name in kwargs['update_fields'] if name != 'version']
+        super().save(*args, **kwargs)
+        Card.objects.filter(pk=self.pk).update(version=models.F('version') + 1)
+        self.refresh_from_db(fields=['version'])
+
     class Meta:
         ordering = ["-month"]
+        constraints = [
+            # одна карточка на автомобиль в месяц, индекс (truck, month) обслуживает и поиск по автомобилю
+            models.UniqueConstraint(fields=['truck', 'month'], name='card_truck_month_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='card_month_idx'),
+        ]
+
+
+class DepartureQuerySet(models.QuerySet):
+    def overlapping(self, date: datetime.date, departure_time: datetime.time, return_time: datetime.time):
+        # выезды, пересекающиеся по времени с интервалом [departure_time, return_time) в день date;
+        # если return_time раньше departure_time, выезд заканчивается на следующий день (через полночь)
+        end_date = date if return_time > departure_time else date + datetime.timedelta(days=1)
+        starts_before_end = models.Q(date__lt=end_date) | models.Q(date=end_date, departure_time__lt=return_time)
+        ends_after_start = models.Q(
+            models.Q(date__gt=date) | models.Q(date=date, return_time__gt=departure_time),
+            return_time__gt=models.F('departure_time')) | models.Q(
+            models.Q(date__gte=date) | models.Q(date=date - datetime.timedelta(days=1), return_time__gt=departure_time),
+            return_time__lte=models.F('departure_time'))
+        return self.filter(starts_before_end, ends_after_start,
+                           date__range=(date - datetime.timedelta(days=1), end_date))
+
+
+class DepartureManager(models.Manager.from_queryset(DepartureQuerySet)):
+    # норма нужна для расхода топлива, карточка с автомобилем - для заголовков и ссылок
+    def get_queryset(self):
+        return super().get_queryset().select_related('card__truck', 'norm')
 
 
 class Departure(models.Model):
@@ -54,11 +121,25 @@ class Departure(models.Model):
     without_pump = models.PositiveIntegerField(blank=True, null=True, verbose_name='без насоса (мин)')
     refueled = models.PositiveIntegerField(blank=True, null=True, verbose_name='заправлено (л)')
 
+    # нарастающие итоги по карточке с учетом этого выезда, в порядке (date, departure_time, id), см. cards.ledger
+    cumulative_distance = models.PositiveIntegerField(default=0, editable=False,
+                                                      verbose_name='пройдено с начала месяца (км)')
+    cumulative_consumption = models.DecimalField(max_digits=12, decimal_places=3, default=0, editable=False,
+                                                 verbose_name='израсходовано с начала месяца (л)')
+    cumulative_refueled = models.PositiveIntegerField(default=0, editable=False,
+                                                      verbose_name='заправлено с начала месяца (л)')
+
     card = models.ForeignKey(Card, related_name='departures', on_delete=models.CASCADE, verbose_name='карточка')
     user = models.ForeignKey(get_user_model(), related_name='departures', on_delete=models.CASCADE,
                              verbose_name='пользователь')
     norm = models.ForeignKey(Norm, related_name="departures", on_delete=models.CASCADE, verbose_name='норма')
 
+    objects = DepartureManager()
+
+    @property
+    def fuel_consumption(self):
+        return consumption.evaluate_departure(self).consumption
+
     def show_departure(self):
         res = f'{self.departure_time.strftime("%H:%M")}-{self.return_time.strftime("%H:%M")}, {self.place_of_work}'
         if self.distance:
@@ -75,7 +156,12 @@ class Departure(models.Model):
         return f'{self.date} - {self.place_of_work}'
 
     class Meta:
-        ordering = ["-date", "-return_time"]
+        ordering = ["-date", "-departure_time"]
+        indexes = [
+            # пересечение выездов по времени и порядок выездов внутри карточки (ordering, нарастающие
+            # итоги в cards.ledger): (card, date, departure_time) - левый префикс этого индекса
+            models.Index(fields=['card', 'date', 'departure_time', 'return_time'], name='departure_interval_idx'),
+        ]
 
     def get_absolute_url(self):
         return reverse('departure_detail', kwargs={'pk': self.id})
@@ -84,3 +170,77 @@ class Departure(models.Model):
         self.departure_time = self.departure_time.replace(second=0)
         self.return_time = self.return_time.replace(second=0)
         super().save(*args, **kwargs)
+
+
+# накопленные итоги по карточке, пересчитываются при изменении выездов (см. cards.ledger)
+class CardTotal(models.Model):
+    card = models.OneToOneField(Card, related_name='total', on_delete=models.CASCADE, verbose_name='карточка')
+    total_distance = models.PositiveIntegerField(default=0, verbose_name='пройдено (км)')
+    total_mileage_consumption = models.DecimalField(max_digits=12, decimal_places=3, default=0,
+                                                    verbose_name='расход по пробегу (л)')
+    total_time_with_pump = models.PositiveIntegerField(default=0, verbose_name='с насосом (мин)')
+    total_with_pump_consumption = models.DecimalField(max_digits=12, decimal_places=3, default=0,
+                                                      verbose_name='расход с насосом (л)')
+    total_time_without_pump = models.PositiveIntegerField(default=0, verbose_name='без насоса (мин)')
+    total_without_pump_consumption = models.DecimalField(max_digits=12, decimal_places=3, default=0,
+                                                         verbose_name='расход без насоса (л)')
+    total_refueled = models.PositiveIntegerField(default=0, verbose_name='заправлено (л)')
+
+    def __str__(self):
+        return f'итоги {self.card_id}'
+
+    @property
+    def total_fuel_consumption(self):
+        return self.total_mileage_consumption + self.total_with_pump_consumption + self.total_without_pump_consumption
+
+    def as_dict(self) -> dict:
+        # те же ключи, что отдавал агрегирующий запрос, шаблоны не меняются
+        total_fuel_consumption = self.total_fuel_consumption
+        return {
+            'total_distance': self.total_distance,
+            'total_mileage_consumption': self.total_mileage_consumption,
+            'total_time_with_pump': self.total_time_with_pump,
+            'total_with_pump_consumption': self.total_with_pump_consumption,
+            'total_time_without_pump': self.total_time_without_pump,
+            'total_without_pump_consumption': self.total_without_pump_consumption,
+            'total_refueled': self.total_refueled,
+            'total_fuel_consumption': total_fuel_consumption,
+            'remaining_fuel': self.card.remaining_fuel + self.total_refueled - total_fuel_consumption,
+            'current_mileage': self.card.mileage + self.total_distance,
+        }
+
+
+# очередь отправки отчетов на email, выполняется командой run_report_jobs (см. cards.jobs)
+class ReportJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'в очереди'
+        RUNNING = 'running', 'выполняется'
+        DONE = 'done', 'отправлено'
+        FAILED = 'failed', 'ошибка'
+
+    template = models.CharField(max_length=100, verbose_name='шаблон отчета')
+    card_ids = models.JSONField(verbose_name='карточки')
+    email = models.EmailField(verbose_name='email')
+    subject = models.CharField(max_length=200, verbose_name='тема письма')
+    filename = models.CharField(max_length=200, verbose_name='имя файла')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING, db_index=True,
+                              verbose_name='статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='попыток')
+    error = models.TextField(blank=True, verbose_name='ошибка')
+    user = models.ForeignKey(get_user_model(), related_name='report_jobs', on_delete=models.SET_NULL,
+                             null=True, blank=True, verbose_name='пользователь')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='создано')
+    # не запускать раньше: пауза перед повтором после ошибки
+    run_after = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='запустить после')
+    # начало выполнения: задачу, выполняющуюся дольше cards.jobs.LEASE_TIMEOUT, забирает другой обработчик
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='начато')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='завершено')
+
+    def __str__(self):
+        return f'{self.subject} -> {self.email} ({self.get_status_display()})'
+
+    def get_absolute_url(self):
+        return reverse('report_job_detail', kwargs={'pk': self.id})
+
+    class Meta:
+        ordering = ['created_at']
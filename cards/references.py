@@ -0,0 +1,116 @@
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceField, ModelChoiceIterator
+
+
+class ReferenceCache:
+    # справочник (нормы, автомобили) в памяти процесса: строки читаются одним запросом и живут
+    # REFERENCE_CACHE_TTL секунд или до сигнала об изменении (см. cards.signals);
+    # если задан REFERENCE_CACHE_ALIAS, строки дополнительно хранятся в общем кеше django,
+    # и холодный процесс берет их оттуда, а не из базы
+
+    def __init__(self, model_label: str):
+        self.model_label = model_label
+        self.rows = None
+        self.by_pk = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    @property
+    def shared_key(self) -> str:
+        return f'references:{self.model_label.lower()}'
+
+    def shared_cache(self):
+        alias = settings.REFERENCE_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def load(self) -> list:
+        shared = self.shared_cache()
+        rows = shared.get(self.shared_key) if shared is not None else None
+        if rows is None:
+            rows = list(self.model._default_manager.all())
+            if shared is not None:
+                shared.set(self.shared_key, rows, settings.REFERENCE_CACHE_TTL)
+        return rows
+
+    def all(self) -> list:
+        with self.lock:
+            if self.rows is None or time.monotonic() - self.loaded_at > settings.REFERENCE_CACHE_TTL:
+                self.rows = self.load()
+                self.by_pk = {str(row.pk): row for row in self.rows}
+                self.loaded_at = time.monotonic()
+            return self.rows
+
+    def get(self, pk):
+        self.all()
+        row = self.by_pk.get(str(pk))
+        if row is None:
+            # строка могла появиться в другом процессе, сигнал о ней сюда не дошел
+            self.invalidate()
+            self.all()
+            row = self.by_pk.get(str(pk))
+        return row
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.rows = None
+            self.by_pk = None
+        shared = self.shared_cache()
+        if shared is not None:
+            shared.delete(self.shared_key)
+
+
+norms = ReferenceCache('cards.Norm')
+trucks = ReferenceCache('cards.Truck')
+
+
+def clear() -> None:
+    norms.invalidate()
+    trucks.invalidate()
+
+
+def departure_norm(departure):
+    # норма выезда без запроса: загруженная вместе с выездом или из справочника
+    if departure._meta.get_field('norm').is_cached(departure):
+        return departure.norm
+    return norms.get(departure.norm_id)
+
+
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield '', self.field.empty_label
+        for obj in self.field.reference.all():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.reference.all()) + (self.field.empty_label is not None)
+
+
+class ReferenceChoiceField(ModelChoiceField):
+    # ModelChoiceField по справочнику из памяти: ни список, ни проверка выбора не ходят в базу
+    iterator = ReferenceChoiceIterator
+
+    def __init__(self, reference: ReferenceCache, **kwargs):
+        self.reference = reference
+        super().__init__(queryset=reference.model._default_manager.none(), **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.reference.model):
+            value = value.pk
+        obj = self.reference.get(value)
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice',
+                                  params={'value': value})
+        return obj
@@ -0,0 +1,167 @@
+import functools
+import logging
+import multiprocessing
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+# прогревочный документ: загружает шрифты и разбирает стили отчетов до первого запроса
+WARMUP_HTML = '<html><body><table><tr><td>Прогрев 0123456789</td></tr></table></body></html>'
+
+
+class RenderError(Exception):
+    pass
+
+
+class RenderBusy(RenderError):
+    pass
+
+
+class RenderTimeout(RenderError):
+    pass
+
+
+def warm_worker() -> None:
+    # initializer процесса пула: процессы запускаются через spawn, django настраивается заново,
+    # weasyprint импортируется один раз, стили и шрифты остаются в памяти процесса
+    import django
+    django.setup()
+    from cards.reports import render_html_pdf
+    render_html_pdf(WARMUP_HTML)
+
+
+def render_html(html_content: str) -> bytes:
+    from cards.reports import render_html_pdf
+    return render_html_pdf(html_content)
+
+
+class RenderPool:
+    # процессы рендера pdf: не больше processes рендеров одновременно и queue в ожидании,
+    # остальным сразу RenderBusy; зависший рендер по timeout перезапускает пул
+    initializer = staticmethod(warm_worker)
+    job = staticmethod(render_html)
+
+    def __init__(self, processes=None, queue=None, timeout=None):
+        self.processes = processes or settings.REPORT_RENDER_PROCESSES
+        self.queue = queue if queue is not None else settings.REPORT_RENDER_QUEUE
+        self.timeout = timeout or settings.REPORT_RENDER_TIMEOUT
+        self.slots = threading.BoundedSemaphore(self.processes + self.queue)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.counters = Counter()
+        self.in_flight = 0
+        self.render_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                    mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=self.initializer)
+                self.counters['starts'] += 1
+            return self.executor
+
+    def restart(self, executor: ProcessPoolExecutor) -> None:
+        # ProcessPoolExecutor не умеет прерывать задачу, поэтому процессы завершаются вместе с пулом
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = None
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def start(self) -> None:
+        # процессы запускаются сразу, а не на первом отчете: каждый выполняет warm_worker
+        executor = self.get_executor()
+        for future in [executor.submit(int) for _ in range(self.processes)]:
+            future.result()
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] += 1
+
+    def render(self, html_content: str) -> bytes:
+        if not self.slots.acquire(blocking=False):
+            self.count('rejected')
+            raise RenderBusy('Очередь рендера отчетов заполнена')
+        started = time.perf_counter()
+        with self.lock:
+            self.in_flight += 1
+        try:
+            executor = self.get_executor()
+            future = executor.submit(self.job, html_content)
+            try:
+                content = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                logger.error('Рендер отчета дольше %s с, пул перезапускается', self.timeout)
+                self.count('timeouts')
+                self.restart(executor)
+                raise RenderTimeout(f'Рендер отчета дольше {self.timeout} с')
+            except BrokenProcessPool as e:
+                self.count('failed')
+                self.restart(executor)
+                raise RenderError('Процесс рендера отчетов завершился') from e
+            except Exception:
+                self.count('failed')
+                raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+        with self.lock:
+            self.counters['completed'] += 1
+            self.render_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+        return content
+
+    def stats(self) -> dict:
+        with self.lock:
+            completed = self.counters['completed']
+            return {
+                'processes': self.processes,
+                'queue': self.queue,
+                'timeout': self.timeout,
+                'running': self.executor is not None,
+                'in_flight': self.in_flight,
+                'starts': self.counters['starts'],
+                'completed': completed,
+                'failed': self.counters['failed'],
+                'timeouts': self.counters['timeouts'],
+                'rejected': self.counters['rejected'],
+                'avg_ms': round(self.render_seconds / completed * 1000, 1) if completed else None,
+                'max_ms': round(self.max_seconds * 1000, 1),
+            }
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+@functools.lru_cache(maxsize=None)
+def render_pool() -> RenderPool:
+    return RenderPool()
+
+
+class RenderBusyMiddleware(MiddlewareMixin):
+    # переполненный, зависший или перезапущенный пул рендера - 503 с Retry-After вместо 500:
+    # перезапуск после таймаута обрывает и остальные рендеры, которые шли в это время (RenderError)
+    def process_exception(self, request, exception):
+        if isinstance(exception, RenderError):
+            response = HttpResponse('Сервис отчетов перегружен, повторите позже', status=503,
+                                    content_type='text/plain; charset=utf-8')
+            response['Retry-After'] = str(settings.REPORT_RENDER_RETRY_AFTER)
+            return response
+        return None
@@ -0,0 +1,206 @@
+import functools
+import hashlib
+import mimetypes
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template.loader import render_to_string
+from weasyprint import HTML, CSS, default_url_fetcher
+
+from cards import rendering
+from cards.ledger import calculated_result
+from cards.models import Card
+from voditel.profiling import timer
+
+
+# относительные ссылки в шаблонах отчетов разрешаются от этого адреса, статика отдается из памяти
+REPORT_BASE_URL = 'http://localhost/'
+REPORT_STYLESHEET = 'cards/report.css'
+
+
+@functools.lru_cache(maxsize=None)
+def load_static(path: str):
+    found = finders.find(path)
+    if not found:
+        return None
+    with open(found, 'rb') as f:
+        return f.read()
+
+
+def static_url_fetcher(url: str, *args, **kwargs) -> dict:
+    static_prefix = urlsplit(REPORT_BASE_URL + settings.STATIC_URL.lstrip('/')).path
+    path = urlsplit(url).path
+    if url.startswith(REPORT_BASE_URL) and path.startswith(static_prefix):
+        content = load_static(path[len(static_prefix):])
+        if content is not None:
+            return {'string': content, 'mime_type': mimetypes.guess_type(path)[0], 'redirected_url': url}
+    return default_url_fetcher(url, *args, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def report_stylesheets() -> tuple:
+    # разобранные стили загружаются один раз на процесс и переиспользуются при каждом рендере
+    return (
+        CSS(string=load_static(REPORT_STYLESHEET).decode(), base_url=REPORT_BASE_URL, url_fetcher=static_url_fetcher),
+        CSS(string='@page {size: landscape}'),
+    )
+
+
+def render_html_pdf(html_content: str) -> bytes:
+    memory_buffer = BytesIO()
+    HTML(string=html_content, base_url=REPORT_BASE_URL, url_fetcher=static_url_fetcher). \
+        write_pdf(target=memory_buffer, stylesheets=list(report_stylesheets()))
+    return memory_buffer.getvalue()
+
+
+def convert_html_to_pdf_stream(template: str, context: dict) -> BytesIO:
+    # шаблон рендерится здесь (контекст - модели), в пул процессов уходит только готовый html
+    html_content = render_to_string(template, context)
+    with timer('pdf'):
+        if settings.REPORT_RENDER_POOL:
+            content = rendering.render_pool().render(html_content)
+        else:
+            content = render_html_pdf(html_content)
+
+    return BytesIO(content)
+
+
+def report_context(cards: list) -> dict:
+    # один шаблон - одна карточка, сводный отчет - список карточек в data
+    if len(cards) == 1:
+        report_data = calculated_result(cards[0])
+        report_data['card'] = cards[0]
+        return report_data
+    reports_data = list()
+    for card in cards:
+        report_data = calculated_result(card)
+        report_data['card'] = card
+        reports_data.append(report_data)
+    return {'data': reports_data}
+
+
+def report_key(template: str, versions: list) -> str:
+    # versions - список (id карточки, версия карточки)
+    # в ключ входит и содержимое стилей, чтобы после их изменения не отдавать старые pdf
+    stamp = ';'.join(f'{pk}:{version}' for pk, version in versions)
+    style = hashlib.sha256(load_static(REPORT_STYLESHEET) or b'').hexdigest()
+    return hashlib.sha256(f'{template}|{stamp}|{style}'.encode()).hexdigest()
+
+
+class ReportCache:
+    # готовые pdf на диске, ключ - шаблон и версии карточек, вытеснение самых давно читанных файлов
+
+    def __init__(self, directory=None, max_size=None):
+        self.directory = directory or settings.REPORT_CACHE_DIR
+        self.max_size = max_size if max_size is not None else settings.REPORT_CACHE_MAX_SIZE
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.pdf')
+
+    def get(self, key: str):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        # время изменения файла служит отметкой последнего чтения; файл мог вытеснить evict()
+        # другого потока или процесса уже после чтения - содержимое все равно отдается
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    def set(self, key: str, content: bytes) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            f.write(content)
+        os.replace(f.name, self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        entries = list()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.pdf'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for mtime, file_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def clear(self) -> None:
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+
+
+def get_report_pdf(template: str, cards: list) -> bytes:
+    cache = ReportCache()
+    key = report_key(template, [(card.pk, card.version) for card in cards])
+    content = cache.get(key)
+    if content is None:
+        content = convert_html_to_pdf_stream(template, report_context(cards)).getvalue()
+        cache.set(key, content)
+    return content
+
+
+@functools.lru_cache(maxsize=None)
+def render_executor() -> ThreadPoolExecutor:
+    # не больше REPORT_RENDER_WORKERS рендеров одновременно, остальные ждут в очереди,
+    # а цикл событий asgi продолжает обслуживать другие запросы; с пулом процессов потоки только
+    # ждут результат, и очередь ограничивает сам пул (cards.rendering.RenderPool)
+    if settings.REPORT_RENDER_POOL:
+        workers = settings.REPORT_RENDER_PROCESSES + settings.REPORT_RENDER_QUEUE
+    else:
+        workers = settings.REPORT_RENDER_WORKERS
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report')
+
+
+async def aget_report_pdf(template: str, cards: list) -> bytes:
+    # cards загружаются с итогами (select_related('total')): поток рендера в базу не ходит
+    return await sync_to_async(get_report_pdf, thread_sensitive=False, executor=render_executor())(template, cards)
+
+
+def report_cards(year: int, month: int = None, truck=None):
+    # карточки для сводного отчета одним запросом: итоги подтягиваются join'ом (автомобиль и норма - менеджером)
+    cards = Card.objects.select_related('total')
+    cards = cards.for_month(year, month) if month else cards.for_year(year)
+    if truck:
+        cards = cards.filter(truck=truck)
+    return cards.order_by('month', 'truck__name', 'truck__number')
+
+
+def combined_template(cards: list) -> str:
+    return 'cards/short_report_pdf.html' if len(cards) == 1 else 'cards/short_reports_pdf.html'
+
+
+def combined_report_pdf(cards: list) -> bytes:
+    return get_report_pdf(combined_template(cards), cards)
+
+
+def report_filename(card: Card) -> str:
+    return f"отчет-{card.truck.name}-{card.truck.number}-{card.month.month}-{card.month.year}.pdf"
+
+
+def bulk_report_zip(cards: list, template: str = 'cards/short_report_pdf.html') -> bytes:
+    # отдельный pdf на каждую карточку, каждый берется из кеша отчетов
+    memory_buffer = BytesIO()
+    with zipfile.ZipFile(memory_buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for card in cards:
+            archive.writestr(report_filename(card), get_report_pdf(template, [card]))
+    return memory_buffer.getvalue()
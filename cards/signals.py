@@ -0,0 +1,83 @@
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_save, pre_save, post_delete
+from django.dispatch import receiver
+
+from cards import ledger, references
+from cards.locking import lock_cards
+from cards.models import Card, CardTotal, Departure, Norm, Truck
+
+
+def bump_card_version(*card_ids):
+    Card.objects.filter(pk__in=card_ids).update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Card)
+def create_card_total(sender, instance, created, raw=False, **kwargs):
+    # raw - загрузка фикстуры (loaddata, copy_sqlite_database): итоги приходят вместе с данными
+    if created and not raw:
+        CardTotal.objects.get_or_create(card=instance)
+
+
+@receiver(pre_save, sender=Departure)
+def remember_old_departure(sender, instance, raw=False, **kwargs):
+    # запоминаем выезд в том виде, в каком он сейчас учтен в итогах
+    instance._ledger_old = None
+    if instance.pk and not raw:
+        instance._ledger_old = Departure.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Departure)
+def update_totals_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_ledger_old', None)
+    if old is not None:
+        old_fuel, fuel = ledger.departures_fuel(old, instance)
+        ledger.apply_departure(old, old_fuel, -1)
+        ledger.shift_following(old, old_fuel, -1)
+    else:
+        (fuel,) = ledger.departures_fuel(instance)
+    ledger.apply_departure(instance, fuel)
+    ledger.shift_following(instance, fuel)
+    ledger.place_departure(instance, fuel)
+    bump_card_version(instance.card_id, *([old.card_id] if old is not None else []))
+
+
+@receiver(post_delete, sender=Departure)
+def update_totals_on_delete(sender, instance, **kwargs):
+    (fuel,) = ledger.departures_fuel(instance)
+    ledger.apply_departure(instance, fuel, -1)
+    ledger.shift_following(instance, fuel, -1)
+    bump_card_version(instance.card_id)
+
+
+@receiver(post_save, sender=Norm)
+@receiver(post_delete, sender=Norm)
+def invalidate_norms(sender, **kwargs):
+    references.norms.invalidate()
+
+
+@receiver(post_save, sender=Truck)
+@receiver(post_delete, sender=Truck)
+def invalidate_trucks(sender, **kwargs):
+    references.trucks.invalidate()
+
+
+@receiver(post_save, sender=Norm)
+def rebuild_totals_on_norm_change(sender, instance, created, raw=False, **kwargs):
+    # изменилась норма - расход по всем выездам с этой нормой другой
+    if not created and not raw:
+        cards = list(Card.objects.filter(departures__norm=instance).distinct())
+        with transaction.atomic():
+            # запись выезда, прочитавшая норму до изменения, завершится раньше пересчета ее карточки
+            lock_cards(*[card.pk for card in cards])
+            for card in cards:
+                ledger.rebuild_card(card)
+        Card.objects.filter(Q(norm=instance) | Q(departures__norm=instance)).update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Truck)
+def bump_versions_on_truck_change(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        instance.cards.update(version=F('version') + 1)
@@ -0,0 +1,31 @@
+from contextlib import contextmanager
+from unittest import mock
+
+from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
+
+
+class LazyLoadError(AssertionError):
+    pass
+
+
+@contextmanager
+def forbid_lazy_loads():
+    # для тестов: обращение к не загруженному заранее внешнему ключу (obj.truck, obj.norm ...)
+    # падает вместо лишнего запроса, так N+1 в шаблонах и view видно сразу
+    def get_object(descriptor, instance):
+        raise LazyLoadError(f'Ленивая загрузка {type(instance).__name__}.{descriptor.field.name} '
+                            f'(pk={instance.pk}), добавьте select_related')
+
+    with mock.patch.object(ForwardManyToOneDescriptor, 'get_object', get_object):
+        yield
+
+
+def query_plan(queryset) -> str:
+    # EXPLAIN QUERY PLAN (sqlite) или EXPLAIN (postgresql) для запроса
+    return queryset.explain()
+
+
+def full_scans(plan: str, tables) -> list:
+    # строки плана sqlite с полным просмотром таблицы (SCAN без индекса)
+    return [line for line in plan.splitlines()
+            if 'SCAN' in line and 'INDEX' not in line and any(table in line.split() for table in tables)]
@@ -0,0 +1,967 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command, CommandError
+from django.db import connection, IntegrityError, OperationalError
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.core.exceptions import ValidationError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from cards import benchmarks, consumption, exports, jobs, ledger, loadtest, locking, references, rendering, reports
+from cards.forms import DepartureAddForm, CardAddForm
+from cards.models import Truck, Norm, Card, Departure, CardTotal, ReportJob
+from cards.testing import forbid_lazy_loads, LazyLoadError, query_plan, full_scans
+from voditel import caching, profiling
+
+
+class CardsTestMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='driver', password='pass')
+        cls.truck = Truck.objects.create(name='Урал', full_name='Урал 5557', number='А001АА')
+        cls.norm = Norm.objects.create(season='Урал зима', liter_per_km=Decimal('0.456'),
+                                       work_with_pump_liter_per_min=Decimal('0.311'),
+                                       work_without_pump_liter_per_min=Decimal('0.123'))
+        cls.card = Card.objects.create(month=datetime.date(2024, 11, 1), mileage=1000,
+                                       remaining_fuel=Decimal('150.500'), truck=cls.truck, norm=cls.norm)
+
+    def add_departure(self, day=1, departure_time='08:00', return_time='09:00', card=None, **kwargs):
+        kwargs.setdefault('norm', self.norm)
+        return Departure.objects.create(
+            date=datetime.date(2024, 11, day),
+            departure_time=datetime.time.fromisoformat(departure_time),
+            return_time=datetime.time.fromisoformat(return_time),
+            place_of_work='тест', card=card or self.card, user=self.user, **kwargs)
+
+
+class CardTotalTest(CardsTestMixin, TestCase):
+    def assertTotalsConsistent(self):
+        self.assertEqual(ledger.verify_card_total(self.card), {})
+
+    def test_totals_follow_departure_changes(self):
+        first = self.add_departure(1, distance=10, with_pump=5, refueled=100)
+        second = self.add_departure(2, distance=7, without_pump=30)
+        self.assertTotalsConsistent()
+
+        first.distance = 12
+        first.save()
+        self.assertTotalsConsistent()
+
+        second.delete()
+        self.assertTotalsConsistent()
+
+        result = ledger.calculated_result(Card.objects.select_related('total').get(pk=self.card.pk))
+        self.assertEqual(result['total_distance'], 12)
+        self.assertEqual(result['current_mileage'], 1012)
+        self.assertEqual(result['remaining_fuel'], Decimal('150.500') + 100 - 12 * Decimal('0.456') - 5 * Decimal('0.311'))
+
+    def test_norm_change_rebuilds_totals(self):
+        self.add_departure(1, distance=10)
+        self.norm.liter_per_km = Decimal('0.500')
+        self.norm.save()
+        self.assertTotalsConsistent()
+        self.assertEqual(CardTotal.objects.get(card=self.card).total_mileage_consumption, Decimal('5.000'))
+
+    def test_read_does_not_aggregate(self):
+        self.add_departure(1, distance=10)
+        card = Card.objects.select_related('total').get(pk=self.card.pk)
+        with self.assertNumQueries(0):
+            ledger.calculated_result(card)
+
+
+class DepartureCumulativeTest(CardsTestMixin, TestCase):
+    def test_cumulative_follows_inserts_edits_and_deletes(self):
+        late = self.add_departure(3, distance=5)
+        early = self.add_departure(1, distance=10, refueled=50)
+        middle = self.add_departure(2, '10:00', '11:00', distance=3)
+        self.assertEqual(ledger.verify_cumulative(self.card), [])
+
+        # перенос выезда в конец месяца
+        early.date = datetime.date(2024, 11, 4)
+        early.save()
+        self.assertEqual(ledger.verify_cumulative(self.card), [])
+
+        middle.delete()
+        self.assertEqual(ledger.verify_cumulative(self.card), [])
+        late.refresh_from_db()
+        self.assertEqual(late.cumulative_distance, 5)
+
+    def test_overnight_departure_follows_morning_departure(self):
+        night = self.add_departure(1, '23:00', '01:00', distance=10)
+        morning = self.add_departure(1, '08:00', '09:00', distance=100)
+        self.assertEqual(ledger.verify_cumulative(self.card), [])
+        self.client.force_login(self.user)
+        response = self.client.get(morning.get_absolute_url())
+        self.assertEqual(response.context['mileage_start'], 1000)
+        response = self.client.get(night.get_absolute_url())
+        self.assertEqual(response.context['mileage_start'], 1100)
+        response = self.client.get(self.card.get_absolute_url())
+        self.assertEqual(response.context['departures'], [[night, morning]])
+
+    def test_verify_against_stored_norms(self):
+        self.add_departure(1, distance=10)
+        references.clear()
+        references.norms.all()
+        Norm.objects.filter(pk=self.norm.pk).update(liter_per_km=Decimal('0.500'))
+        # сверка идет по нормам из базы, а не по устаревшему справочнику процесса
+        self.assertEqual(len(ledger.verify_cumulative(self.card)), 1)
+        ledger.rebuild_card(self.card)
+        self.assertEqual(ledger.verify_cumulative(self.card), [])
+
+    def test_departure_detail_mileage(self):
+        self.add_departure(1, distance=10)
+        departure = self.add_departure(2, distance=4)
+        self.client.force_login(self.user)
+        response = self.client.get(departure.get_absolute_url())
+        self.assertEqual(response.context['mileage_start'], 1010)
+        self.assertEqual(response.context['mileage_end'], 1014)
+
+
+class DepartureOverlapTest(CardsTestMixin, TestCase):
+    def make_form(self, day, departure_time, return_time):
+        data = {'date': datetime.date(2024, 11, day), 'departure_time': departure_time, 'return_time': return_time,
+                'place_of_work': 'тест', 'distance': 1,
+                'card': self.card.pk, 'user': self.user.pk, 'norm': self.norm.pk}
+        return DepartureAddForm(data=data, initial={'card': self.card})
+
+    def test_overlaps(self):
+        self.add_departure(10, '08:00', '09:00')
+        self.add_departure(10, '23:00', '01:00')  # через полночь
+        cases = [
+            (10, '09:00', '10:00', True),
+            (10, '07:00', '08:00', True),
+            (10, '08:30', '08:45', False),
+            (10, '07:00', '10:00', False),
+            (10, '22:00', '23:30', False),
+            (11, '00:30', '02:00', False),
+            (11, '01:00', '02:00', True),
+            (9, '23:00', '07:30', True),
+            (9, '23:00', '08:30', False),
+            (10, '12:00', '12:00', False),
+        ]
+        for day, departure_time, return_time, valid in cases:
+            with self.subTest(day=day, departure_time=departure_time, return_time=return_time):
+                self.assertEqual(self.make_form(day, departure_time, return_time).is_valid(), valid)
+
+    def test_validation_is_flat_in_card_size(self):
+        # число запросов проверки не зависит от числа выездов в карточке, запрос пересечений идет по индексу
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(20):
+                    form = self.make_form(15, '12:00', '13:00')
+                    form.is_valid()
+            return len(queries)
+
+        small_queries = count_queries()
+        Departure.objects.bulk_create(
+            Departure(date=datetime.date(2024, 11, 1) + datetime.timedelta(days=i // 10),
+                      departure_time=datetime.time(i % 10 * 2), return_time=datetime.time(i % 10 * 2 + 1),
+                      place_of_work='тест', distance=1, card=self.card, user=self.user, norm=self.norm)
+            for i in range(5000))
+        self.assertEqual(count_queries(), small_queries)
+
+        if connection.vendor == 'sqlite':
+            plan = query_plan(self.card.departures.overlapping(
+                datetime.date(2024, 11, 15), datetime.time(12), datetime.time(13)))
+            self.assertEqual(full_scans(plan, ('cards_departure',)), [], plan)
+
+
+class CardDetailPaginationTest(CardsTestMixin, TestCase):
+    def test_only_page_dates_are_fetched(self):
+        for day in range(1, 11):
+            self.add_departure(day, distance=1)
+            self.add_departure(day, '10:00', '11:00', distance=1)
+        self.client.force_login(self.user)
+
+        response = self.client.get(self.card.get_absolute_url())
+        groups = response.context['departures']
+        self.assertEqual([deps[0].date.day for deps in groups], [10, 9, 8, 7, 6, 5, 4])
+        self.assertTrue(all(len(deps) == 2 for deps in groups))
+        self.assertEqual(response.context['paginator'].num_pages, 2)
+
+        response = self.client.get(self.card.get_absolute_url(), {'page': 2})
+        self.assertEqual([deps[0].date.day for deps in response.context['departures']], [3, 2, 1])
+
+
+class ReportCacheTest(CardsTestMixin, TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_override = override_settings(REPORT_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+
+    def test_repeat_download_served_from_cache(self):
+        self.add_departure(1, distance=10)
+        url = reverse('short_report', kwargs={'pk': self.card.pk})
+        with mock.patch('cards.reports.convert_html_to_pdf_stream',
+                        wraps=reports.convert_html_to_pdf_stream) as render:
+            response = self.client.get(url)
+            etag = response['ETag']
+            self.client.get(url)
+            self.assertEqual(render.call_count, 1)
+
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            # новый выезд меняет версию карточки
+            self.add_departure(2, distance=5)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual(render.call_count, 2)
+
+    def test_hit_survives_concurrent_eviction(self):
+        cache = reports.ReportCache(self.cache_dir)
+        cache.set('key', b'%PDF')
+        with mock.patch('cards.reports.os.utime', side_effect=FileNotFoundError):
+            self.assertEqual(cache.get('key'), b'%PDF')
+
+    def test_stale_card_save_bumps_version(self):
+        card = Card.objects.get(pk=self.card.pk)
+        self.add_departure(1, distance=10)
+        version = Card.objects.get(pk=card.pk).version
+        card.mileage = 2000
+        card.save()
+        self.assertEqual(card.version, version + 1)
+        self.assertEqual(Card.objects.get(pk=card.pk).version, version + 1)
+        self.assertEqual(Card.objects.get(pk=card.pk).mileage, 2000)
+
+    def test_eviction_keeps_size_under_limit(self):
+        cache = reports.ReportCache(self.cache_dir, max_size=25)
+        for i in range(5):
+            cache.set(f'key{i}', b'0123456789')
+            os.utime(cache.path(f'key{i}'), (i, i))
+        cache.get('key3')
+        cache.set('key5', b'0123456789')
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['key3.pdf', 'key5.pdf'])
+
+
+class AsyncReportTest(CardsTestMixin, TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_override = override_settings(REPORT_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_anonymous_is_redirected_to_login(self):
+        for name in ('full_report', 'short_report'):
+            response = self.client.get(reverse(name, kwargs={'pk': self.card.pk}))
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response['Location'].startswith(reverse('users:login')))
+        self.assertEqual(self.client.get(reverse('report_choice')).status_code, 302)
+
+    def test_pdf_is_rendered_in_report_pool(self):
+        self.add_departure(1, distance=10)
+        self.client.force_login(self.user)
+        threads = list()
+
+        def render(template, context):
+            threads.append(threading.current_thread().name)
+            return BytesIO(b'%PDF')
+
+        with mock.patch('cards.reports.convert_html_to_pdf_stream', side_effect=render):
+            response = self.client.get(reverse('full_report', kwargs={'pk': self.card.pk}))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b'%PDF')
+            response = self.client.get(reverse('full_report', kwargs={'pk': self.card.pk}),
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('report'))
+
+    def test_report_choice(self):
+        self.add_departure(1, distance=10)
+        self.client.force_login(self.user)
+        url = reverse('report_choice')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with mock.patch('cards.reports.convert_html_to_pdf_stream', return_value=BytesIO(b'%PDF')) as render:
+            response = self.client.post(url, {'year': 2024, 'month': 11, 'email': 'boss@example.com'})
+            self.assertEqual(response.content, b'%PDF')
+            self.assertEqual(render.call_args.args[0], 'cards/short_report_pdf.html')
+        self.assertEqual(ReportJob.objects.get().email, 'boss@example.com')
+
+        response = self.client.post(url, {'year': 2023, 'month': 1})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+
+
+class SleepPool(rendering.RenderPool):
+    initializer = None
+    job = staticmethod(time.sleep)
+
+
+class RenderPoolTest(CardsTestMixin, TestCase):
+    def test_pool_renders_in_warm_process(self):
+        pool = rendering.RenderPool(processes=1, queue=0, timeout=60)
+        self.addCleanup(pool.shutdown)
+        pool.start()
+        content = pool.render('<p>отчет</p>')
+        self.assertTrue(content.startswith(b'%PDF'))
+        stats = pool.stats()
+        self.assertEqual((stats['starts'], stats['completed'], stats['in_flight']), (1, 1, 0))
+
+    def test_full_queue_is_rejected(self):
+        pool = rendering.RenderPool(processes=1, queue=0, timeout=60)
+        pool.slots.acquire()
+        with self.assertRaises(rendering.RenderBusy):
+            pool.render('<p>отчет</p>')
+        self.assertEqual(pool.stats()['rejected'], 1)
+
+    def test_timeout_restarts_pool(self):
+        pool = SleepPool(processes=1, queue=0, timeout=0.5)
+        self.addCleanup(pool.shutdown)
+        pool.render(0)
+        with self.assertLogs('cards.rendering', 'ERROR'), self.assertRaises(rendering.RenderTimeout):
+            pool.render(30)
+        self.assertIsNone(pool.executor)
+        pool.render(0)
+        stats = pool.stats()
+        self.assertEqual((stats['starts'], stats['timeouts'], stats['completed']), (2, 1, 2))
+
+    def test_busy_pool_answers_503(self):
+        self.client.force_login(self.user)
+        url = reverse('short_report', kwargs={'pk': self.card.pk})
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                override_settings(REPORT_CACHE_DIR=cache_dir, REPORT_RENDER_POOL=True), \
+                mock.patch.object(rendering.RenderPool, 'render', side_effect=rendering.RenderBusy):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_render_interrupted_by_restart_answers_503(self):
+        # рендер, оборванный перезапуском пула после чужого таймаута (BrokenProcessPool)
+        self.client.force_login(self.user)
+        url = reverse('short_report', kwargs={'pk': self.card.pk})
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                override_settings(REPORT_CACHE_DIR=cache_dir, REPORT_RENDER_POOL=True), \
+                mock.patch.object(rendering.RenderPool, 'render',
+                                  side_effect=rendering.RenderError('Процесс рендера отчетов завершился')):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_stats_for_staff_only(self):
+        url = reverse('report_render_stats')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.json()['enabled'], False)
+        self.assertIn('rejected', response.json())
+
+
+class ReportJobTest(CardsTestMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_email_is_queued_and_sent_by_worker(self):
+        self.add_departure(1, distance=10)
+        with mock.patch('cards.reports.convert_html_to_pdf_stream') as render:
+            response = self.client.get(reverse('full_report_email', kwargs={'pk': self.card.pk}))
+            self.assertEqual(response.status_code, 200)
+            response = self.client.post(reverse('full_report_email', kwargs={'pk': self.card.pk}),
+                                        {'email': 'boss@example.com'})
+            render.assert_not_called()
+        job = ReportJob.objects.get()
+        self.assertRedirects(response, job.get_absolute_url())
+        self.assertEqual(job.status, ReportJob.Status.PENDING)
+        self.assertEqual(len(mail.outbox), 0)
+
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(REPORT_CACHE_DIR=cache_dir):
+            self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.Status.DONE)
+        self.assertEqual(mail.outbox[0].to, ['boss@example.com'])
+        self.assertEqual(mail.outbox[0].attachments[0][0], job.filename)
+
+    def test_job_visible_to_owner_only(self):
+        job = jobs.enqueue_report_email('cards/short_report_pdf.html', [self.card], 'boss@example.com',
+                                        user=self.user)
+        self.assertContains(self.client.get(job.get_absolute_url()), 'boss@example.com')
+        other = get_user_model().objects.create_user(username='other', password='pass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(job.get_absolute_url()).status_code, 404)
+
+    def test_failed_job_is_retried(self):
+        job = jobs.enqueue_report_email('cards/short_report_pdf.html', [self.card], 'boss@example.com')
+        with mock.patch('cards.jobs.get_report_pdf', side_effect=OSError('нет шрифтов')), \
+                self.assertLogs('cards.jobs', 'ERROR'):
+            for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+                self.assertEqual(jobs.run_pending(), 1)
+                # до конца паузы задача не запускается повторно
+                self.assertEqual(jobs.run_pending(), 0)
+                job.refresh_from_db()
+                if attempt < jobs.MAX_ATTEMPTS:
+                    self.assertGreater(job.run_after, timezone.now() + jobs.RETRY_DELAY * 2 ** (attempt - 1)
+                                       - datetime.timedelta(seconds=5))
+                    ReportJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(job.status, ReportJob.Status.FAILED)
+        self.assertEqual(job.attempts, jobs.MAX_ATTEMPTS)
+        self.assertEqual(job.error, 'нет шрифтов')
+
+    def test_abandoned_job_is_reclaimed(self):
+        job = jobs.enqueue_report_email('cards/short_report_pdf.html', [self.card], 'boss@example.com')
+        self.assertEqual(jobs.claim_next_job(), job)
+        # обработчик упал, задача осталась RUNNING
+        self.assertIsNone(jobs.claim_next_job())
+        ReportJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - jobs.LEASE_TIMEOUT * 2)
+        with self.assertLogs('cards.jobs', 'WARNING'):
+            job = jobs.claim_next_job()
+        self.assertEqual((job.status, job.attempts), (ReportJob.Status.RUNNING, 2))
+
+        ReportJob.objects.filter(pk=job.pk).update(attempts=jobs.MAX_ATTEMPTS,
+                                                   started_at=timezone.now() - jobs.LEASE_TIMEOUT * 2)
+        with self.assertLogs('cards.jobs', 'WARNING'):
+            self.assertIsNone(jobs.claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.Status.FAILED)
+
+
+class ReportStylesheetTest(TestCase):
+    def test_static_assets_served_from_memory(self):
+        with mock.patch('cards.reports.default_url_fetcher') as fetch:
+            result = reports.static_url_fetcher(reports.REPORT_BASE_URL + 'static/' + reports.REPORT_STYLESHEET)
+            fetch.assert_not_called()
+        self.assertEqual(result['mime_type'], 'text/css')
+        self.assertIn(b'.table', result['string'])
+
+    def test_stylesheets_parsed_once(self):
+        self.assertIs(reports.report_stylesheets(), reports.report_stylesheets())
+
+    def test_templates_do_not_use_cdn(self):
+        for template in ('full_report_pdf', 'short_report_pdf', 'short_reports_pdf'):
+            with open(get_template(f'cards/{template}.html').origin.name) as f:
+                self.assertNotIn('cdn.', f.read())
+
+
+class BulkReportTest(CardsTestMixin, TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_override = override_settings(REPORT_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+
+    year = datetime.date.today().year
+
+    def create_fleet(self, trucks, year=2024):
+        for i in range(trucks):
+            truck = Truck.objects.create(name=f'Камаз{i}', full_name='Камаз 43118', number=f'В{i:03}ВВ')
+            card = Card.objects.create(month=datetime.date(year, 11, 1), mileage=0, remaining_fuel=100,
+                                       truck=truck, norm=self.norm)
+            self.add_departure(1, distance=i + 1, card=card)
+
+    def test_query_count_does_not_depend_on_card_count(self):
+        self.create_fleet(2)
+        with CaptureQueriesContext(connection) as small:
+            reports.report_context(list(reports.report_cards(year=2024, month=11)))
+        self.create_fleet(10)
+        with self.assertNumQueries(len(small)):
+            context = reports.report_context(list(reports.report_cards(year=2024, month=11)))
+        self.assertEqual(len(context['data']), 13)
+
+    def test_zip_export(self):
+        self.create_fleet(3, self.year)
+        response = self.client.post(reverse('bulk_report'), {'year': self.year, 'month': 11, 'format': 'zip',
+                                                             'template': 'cards/full_report_pdf.html'})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(response.content)) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+
+    def test_truck_filter_single_pdf(self):
+        self.create_fleet(3, self.year)
+        truck = Truck.objects.get(name='Камаз1')
+        response = self.client.post(reverse('bulk_report'), {'year': self.year, 'truck': truck.pk, 'format': 'pdf',
+                                                             'template': 'cards/short_report_pdf.html'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual([card.truck for card in reports.report_cards(year=self.year, truck=truck)], [truck])
+
+
+class ExportTest(CardsTestMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_departures_csv_is_streamed(self):
+        self.add_departure(1, distance=10)
+        self.add_departure(2, distance=5, refueled=40)
+        response = self.client.get(reverse('departure_export'),
+                                   {'date_from': '2024-11-01', 'date_to': '2024-11-30'})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines(), delimiter=';'))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2][-1], '1015')
+
+    def test_card_totals_csv(self):
+        self.add_departure(1, distance=10)
+        response = self.client.get(reverse('card_total_export'),
+                                   {'date_from': '2024-01-01', 'date_to': '2024-12-31', 'truck': self.truck.pk})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines(), delimiter=';'))
+        self.assertEqual(rows[1][:3], ['11.2024', 'Урал', 'А001АА'])
+        self.assertEqual(rows[1][5], '1010')
+
+    async def test_csv_is_streamed_asynchronously_under_asgi(self):
+        await sync_to_async(self.add_departure)(1, distance=10)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('departure_export'),
+                                               {'date_from': '2024-11-01', 'date_to': '2024-11-30'})
+        self.assertTrue(response.is_async)
+        content = b''.join([part async for part in response.streaming_content])
+        self.assertEqual(len(content.decode('utf-8-sig').splitlines()), 2)
+
+    def test_departures_xlsx(self):
+        departure = self.add_departure(1, distance=10)
+        Departure.objects.filter(pk=departure.pk).update(place_of_work='ул. Мира, 1 <склад>')
+        response = self.client.get(reverse('departure_export'),
+                                   {'date_from': '2024-11-01', 'date_to': '2024-11-30', 'file_format': 'xlsx'})
+        self.assertEqual(response['Content-Type'], exports.XLSX_CONTENT_TYPE)
+        self.assertIn('.xlsx', response['Content-Disposition'])
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIn('xl/workbook.xml', archive.namelist())
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 2)
+        self.assertIn('ул. Мира, 1 &lt;склад&gt;', sheet)
+        self.assertIn('<c><v>4.560</v></c><c><v>1010</v></c>', sheet)
+
+    def test_card_totals_from_mid_month_without_total_row(self):
+        self.add_departure(1, distance=10)
+        CardTotal.objects.filter(card=self.card).delete()
+        response = self.client.get(reverse('card_total_export'),
+                                   {'date_from': '2024-11-15', 'date_to': '2024-11-20'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines(), delimiter=';'))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][5], '1010')
+
+
+class BenchmarkBudgetTest(TestCase):
+    def test_views_within_query_budget(self):
+        fleet = benchmarks.seed_fleet(trucks=3, months=4, departures=40)
+        results = benchmarks.run_benchmarks(fleet, repeat=1)
+        self.assertEqual({result['view'] for result in results}, set(benchmarks.QUERY_BUDGETS))
+        for result in results:
+            with self.subTest(view=result['view']):
+                self.assertEqual(result['status'], 200)
+                self.assertFalse(result['over_budget'], result)
+
+
+class ProfilingTest(CardsTestMixin, TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, 'profile.log')
+        settings = override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0,
+                                     PROFILING_LOG_FILE=self.log_file)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.log_dir)
+        self.addCleanup(self.close_handlers)
+        self.client.force_login(self.user)
+
+    def close_handlers(self):
+        logger = logging.getLogger('voditel.profiling')
+        for handler in list(logger.handlers):
+            if handler.baseFilename == self.log_file:
+                logger.removeHandler(handler)
+                handler.close()
+
+    def records(self):
+        with open(self.log_file, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_normalize_sql(self):
+        self.assertEqual(profiling.normalize_sql('SELECT * FROM t WHERE id = 12 AND name = \'x\''),
+                         profiling.normalize_sql('SELECT *  FROM t WHERE id = 7 AND name = \'yy\''))
+        self.assertEqual(profiling.normalize_sql('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+                         'SELECT * FROM t WHERE id IN (...)')
+
+    def test_request_is_recorded(self):
+        self.add_departure(1, distance=10)
+        self.client.get(reverse('card_detail', kwargs={'pk': self.card.pk}))
+        record = self.records()[-1]
+        self.assertEqual(record['url_name'], 'card_detail')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+    async def test_request_is_recorded_under_asgi(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(profiling.ProfilingMiddleware(get_response)))
+        await sync_to_async(self.add_departure)(1, distance=10)
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.get(reverse('card_detail', kwargs={'pk': self.card.pk}))
+        record = self.records()[-1]
+        self.assertEqual(record['url_name'], 'card_detail')
+        # запросы из потока sync_to_async попадают в статистику запроса
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+    def test_duplicate_queries_are_flagged(self):
+        stats = profiling.RequestStats()
+        with connection.execute_wrapper(stats.record_query):
+            for card in Card.objects.select_related(None):
+                Truck.objects.get(pk=card.truck_id)
+                Norm.objects.get(pk=card.norm_id)
+            Truck.objects.get(pk=self.truck.pk)
+        duplicates = stats.duplicates(2)
+        self.assertEqual(len(duplicates), 1)
+        self.assertIn('"cards_truck"', duplicates[0]['sql'])
+        self.assertEqual(duplicates[0]['count'], 2)
+
+    def test_summary(self):
+        for _ in range(3):
+            self.client.get(reverse('card_detail', kwargs={'pk': self.card.pk}))
+        out = StringIO()
+        call_command('profile_summary', '--json', stdout=out)
+        summary = json.loads(out.getvalue())
+        self.assertEqual(summary[0]['view'], 'card_detail')
+        self.assertEqual(summary[0]['count'], 3)
+        self.assertLessEqual(summary[0]['p50'], summary[0]['p99'])
+
+
+class LazyLoadTest(TestCase):
+    def test_views_do_not_load_foreign_keys_lazily(self):
+        fleet = benchmarks.seed_fleet(trucks=2, months=2, departures=10)
+        self.client.force_login(fleet['user'])
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(REPORT_CACHE_DIR=cache_dir):
+            for name, url in benchmarks.view_urls(fleet).items():
+                with self.subTest(view=name), forbid_lazy_loads():
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_guard_raises_on_lazy_load(self):
+        fleet = benchmarks.seed_fleet(trucks=1, months=1, departures=1)
+        card = Card.objects.select_related(None).get(pk=fleet['card'].pk)
+        with forbid_lazy_loads(), self.assertRaises(LazyLoadError):
+            str(card)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'разбор EXPLAIN QUERY PLAN sqlite')
+class QueryPlanTest(CardsTestMixin, TestCase):
+    tables = ('cards_card', 'cards_departure')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = query_plan(queryset)
+        self.assertFalse(full_scans(plan, self.tables), plan)
+        self.assertIn(index, plan)
+
+    def test_card_by_truck_and_month(self):
+        queryset = Card.objects.filter(truck=self.truck, month=datetime.date(2024, 11, 1))
+        self.assertUsesIndex(queryset, 'sqlite_autoindex_cards_card')
+
+    def test_cards_by_month_range(self):
+        self.assertUsesIndex(Card.objects.for_month(2024, 11), 'card_month_idx')
+        self.assertUsesIndex(Card.objects.for_year(2024), 'card_month_idx')
+
+    def test_card_list(self):
+        self.assertUsesIndex(Card.objects.all()[:7], 'card_month_idx')
+
+    def test_card_departures(self):
+        self.assertUsesIndex(self.card.departures.all(), 'departure_interval_idx')
+        self.assertNotIn('TEMP B-TREE', query_plan(self.card.departures.all()))
+
+    def test_overlapping_and_following_departures(self):
+        departure = self.add_departure(3)
+        self.assertUsesIndex(self.card.departures.overlapping(departure.date, datetime.time(8), datetime.time(9)),
+                             'departure_interval_idx')
+        self.assertUsesIndex(Departure.objects.filter(ledger.departure_position(departure), card=self.card),
+                             'departure_interval_idx')
+
+
+class CardUniqueMonthTest(CardsTestMixin, TestCase):
+    def test_month_is_first_day(self):
+        card = Card.objects.create(month=datetime.date(2024, 12, 15), mileage=0, remaining_fuel=0,
+                                   truck=self.truck, norm=self.norm)
+        self.assertEqual(card.month, datetime.date(2024, 12, 1))
+
+    def test_one_card_per_truck_and_month(self):
+        with self.assertRaises(IntegrityError):
+            Card.objects.create(month=datetime.date(2024, 11, 20), mileage=0, remaining_fuel=0,
+                                truck=self.truck, norm=self.norm)
+
+
+class CardMonthLookupTest(CardsTestMixin, TestCase):
+    def card_form(self, month, instance=None):
+        return CardAddForm({'month': month, 'mileage': 0, 'remaining_fuel': 0, 'truck': self.truck.pk,
+                            'norm': self.norm.pk}, instance=instance, update=instance is not None)
+
+    def test_for_month_and_year(self):
+        december = Card.objects.create(month=datetime.date(2024, 12, 1), mileage=0, remaining_fuel=0,
+                                       truck=self.truck, norm=self.norm)
+        Card.objects.create(month=datetime.date(2025, 1, 1), mileage=0, remaining_fuel=0,
+                            truck=self.truck, norm=self.norm)
+        self.assertEqual(list(Card.objects.for_month(2024, 12)), [december])
+        self.assertEqual(set(Card.objects.for_year(2024)), {december, self.card})
+        self.assertNotIn('strftime', str(Card.objects.for_month(2024, 12).query))
+
+    def test_same_month_of_another_year_is_allowed(self):
+        self.assertTrue(self.card_form('2025-11-01').is_valid())
+        self.assertFalse(self.card_form('2024-11-01').is_valid())
+
+    def test_update_keeps_own_month(self):
+        self.assertTrue(self.card_form('2024-11-01', instance=self.card).is_valid())
+        other = Card.objects.create(month=datetime.date(2024, 12, 1), mileage=0, remaining_fuel=0,
+                                    truck=self.truck, norm=self.norm)
+        self.assertFalse(self.card_form('2024-11-01', instance=other).is_valid())
+
+
+class ReferenceCacheTest(CardsTestMixin, TestCase):
+    def setUp(self):
+        references.clear()
+        self.client.force_login(self.user)
+
+    def test_warm_norm_list_does_not_query_norms(self):
+        self.client.get(reverse('norm_list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('norm_list'))
+        self.assertContains(response, 'Урал зима')
+        self.assertFalse([q for q in queries if 'cards_norm' in q['sql']])
+
+    def test_choice_field_uses_cache(self):
+        references.trucks.all()
+        references.norms.all()
+        with self.assertNumQueries(0):
+            form = CardAddForm()
+            html = form['truck'].as_widget()
+            self.assertEqual(form.fields['truck'].clean(str(self.truck.pk)), self.truck)
+        self.assertIn('Урал - А001АА', html)
+        with self.assertRaises(ValidationError):
+            form.fields['norm'].clean('100500')
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(references.norms.get(self.norm.pk).liter_per_km, Decimal('0.456'))
+        self.norm.liter_per_km = Decimal('0.500')
+        self.norm.save()
+        self.assertEqual(references.norms.get(self.norm.pk).liter_per_km, Decimal('0.500'))
+        truck = Truck.objects.create(name='Камаз', full_name='Камаз 43118', number='В002ВВ')
+        self.assertIn(truck, references.trucks.all())
+        truck.delete()
+        self.assertNotIn(truck, references.trucks.all())
+
+    def test_consumption_without_norm_query(self):
+        departure = self.add_departure(1, distance=10)
+        departure = Departure.objects.select_related(None).get(pk=departure.pk)
+        references.norms.all()
+        with self.assertNumQueries(0):
+            self.assertEqual(departure.fuel_consumption, Decimal('4.560') + 60 * Decimal('0'))
+
+    def test_ledger_ignores_stale_cache(self):
+        references.norms.all()
+        # норму изменили в другом процессе: сигнал сюда не дошел, справочник устарел
+        Norm.objects.filter(pk=self.norm.pk).update(liter_per_km=Decimal('0.500'))
+        self.assertEqual(references.norms.get(self.norm.pk).liter_per_km, Decimal('0.456'))
+        departure = self.add_departure(1, distance=10)
+        departure.refresh_from_db()
+        self.assertEqual(CardTotal.objects.get(card=self.card).total_mileage_consumption, Decimal('5.000'))
+        self.assertEqual(departure.cumulative_consumption, Decimal('5.000'))
+        self.assertEqual(ledger.verify_card_total(self.card), {})
+
+    def test_ledger_reads_norms_once_per_write(self):
+        def norm_queries(action):
+            with CaptureQueriesContext(connection) as queries:
+                action()
+            return [q for q in queries if 'FROM "cards_norm"' in q['sql']]
+
+        departure = Departure.objects.get(pk=self.add_departure(1, distance=10).pk)
+        self.assertEqual(len(norm_queries(lambda: self.add_departure(2, distance=5))), 1)
+        departure.distance = 20
+        self.assertEqual(len(norm_queries(departure.save)), 1)
+        self.assertEqual(len(norm_queries(departure.delete)), 1)
+        self.assertEqual(ledger.verify_card_total(self.card), {})
+
+    def test_shared_tier(self):
+        with override_settings(REFERENCE_CACHE_ALIAS='default'):
+            references.norms.all()
+            # другой процесс: пустая память, строки из общего кеша
+            other = references.ReferenceCache('cards.Norm')
+            with self.assertNumQueries(0):
+                self.assertEqual(other.get(self.norm.pk), self.norm)
+            references.norms.invalidate()
+            with self.assertNumQueries(1):
+                references.ReferenceCache('cards.Norm').all()
+
+
+class CachingTest(CardsTestMixin, TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+
+    def test_get_or_set_and_invalidate(self):
+        compute = mock.Mock(side_effect=[1, 2])
+        self.assertEqual(caching.get_or_set('totals', 'card', 1, default=compute), 1)
+        self.assertEqual(caching.get_or_set('totals', 'card', 1, default=compute), 1)
+        caching.invalidate('totals')
+        self.assertEqual(caching.get_or_set('totals', 'card', 1, default=compute), 2)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_cached_decorator(self):
+        compute = mock.Mock(side_effect=lambda year, month=None: (year, month))
+
+        @caching.cached('months')
+        def months(year, month=None):
+            return compute(year, month=month)
+
+        self.assertEqual(months(2024, month=11), (2024, 11))
+        self.assertEqual(months(2024, month=11), (2024, 11))
+        self.assertEqual(months(2024), (2024, None))
+        self.assertEqual(compute.call_count, 2)
+        months.invalidate()
+        months(2024)
+        self.assertEqual(compute.call_count, 3)
+
+    def test_long_keys_are_hashed(self):
+        key = caching.make_key('reports', 'шаблон с пробелами', 'x' * 300)
+        self.assertLess(len(key), 100)
+
+    def test_session_read_from_cache(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('card_list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('card_list')).status_code, 200)
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+        self.assertFalse([query for query in queries if 'users_user' in query['sql']])
+
+
+class ConsumptionTest(CardsTestMixin, TestCase):
+    def add_random_departures(self, count, seed=0):
+        rnd = random.Random(seed)
+        other_norm = Norm.objects.create(season='Урал лето', liter_per_km=Decimal('0.417'),
+                                         work_with_pump_liter_per_min=Decimal('0.299'),
+                                         work_without_pump_liter_per_min=Decimal('0.107'))
+        for i in range(count):
+            self.add_departure(i // 4 + 1, f'{6 + i % 4 * 2:02}:00', f'{7 + i % 4 * 2:02}:00',
+                               distance=rnd.choice([None, rnd.randint(0, 60)]),
+                               with_pump=rnd.choice([None, rnd.randint(1, 90)]),
+                               without_pump=rnd.randint(1, 90), refueled=rnd.choice([None, 50, 100]),
+                               norm=rnd.choice([self.norm, other_norm]))
+
+    def test_totals_match_sql_aggregate(self):
+        self.add_random_departures(60)
+        expected = ledger.aggregate_card_totals(self.card)
+        totals = consumption.totals(consumption.card_fuel(self.card))
+        for field in ledger.TOTAL_FIELDS:
+            with self.subTest(field=field):
+                self.assertEqual(Decimal(totals[field]), Decimal(expected[field]).quantize(Decimal('0.001')))
+
+    def test_batch_matches_single_departures(self):
+        self.add_random_departures(20, seed=1)
+        departures = list(self.card.departures.order_by('date', 'departure_time', 'id'))
+        results = consumption.card_fuel(self.card)
+        cumulative = Decimal(0)
+        for departure, fuel in zip(departures, results):
+            cumulative += departure.fuel_consumption
+            self.assertEqual(fuel.pk, departure.pk)
+            self.assertEqual(fuel.consumption, consumption.evaluate_departure(departure).consumption)
+            self.assertEqual(fuel.cumulative_consumption, cumulative)
+            self.assertEqual(fuel.cumulative_consumption, departure.cumulative_consumption)
+
+    def test_single_norm_batch(self):
+        rows = [(1, self.norm.pk, 10, None, 30, None), (2, self.norm.pk, None, 20, None, 100)]
+        first, second = consumption.evaluate_batch(rows)
+        self.assertEqual(first.consumption, Decimal('4.560') + Decimal('3.690'))
+        self.assertEqual(second.cumulative_consumption, first.consumption + Decimal('6.220'))
+        self.assertEqual((second.cumulative_distance, second.cumulative_refueled), (10, 100))
+        self.assertEqual(consumption.evaluate_batch([]), [])
+
+    def test_rebuild_card_single_pass(self):
+        self.add_random_departures(12, seed=2)
+        CardTotal.objects.filter(card=self.card).update(total_distance=0)
+        Departure.objects.filter(card=self.card).update(cumulative_distance=0)
+        ledger.rebuild_card(self.card)
+        self.assertEqual(ledger.verify_card_total(self.card), {})
+        self.assertEqual(ledger.verify_cumulative(self.card), [])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'копия тестовой базы sqlite в файл')
+class CopySqliteDatabaseTest(TransactionTestCase):
+    def test_copy(self):
+        user = get_user_model().objects.create_user(username='driver', password='driver')
+        truck = Truck.objects.create(name='Урал', full_name='Урал 5557', number='А001АА')
+        norm = Norm.objects.create(season='Урал зима', liter_per_km=Decimal('0.456'),
+                                   work_with_pump_liter_per_min=Decimal('0.311'),
+                                   work_without_pump_liter_per_min=Decimal('0.123'))
+        card = Card.objects.create(month=datetime.date(2024, 11, 1), mileage=1000, remaining_fuel=150,
+                                   truck=truck, norm=norm)
+        for day in (1, 2):
+            Departure.objects.create(date=datetime.date(2024, 11, day), departure_time=datetime.time(8),
+                                     return_time=datetime.time(9), place_of_work='тест', distance=10,
+                                     card=card, user=user, norm=norm)
+        expected = CardTotal.objects.get(card=card).as_dict()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'db.sqlite3')
+            connection.ensure_connection()
+            destination = sqlite3.connect(source)
+            connection.connection.backup(destination)
+            destination.close()
+            call_command('flush', interactive=False, verbosity=0)
+            self.assertFalse(Card.objects.exists())
+
+            call_command('copy_sqlite_database', source, stdout=StringIO())
+
+        card = Card.objects.get(pk=card.pk)
+        self.assertEqual(card.total.as_dict(), expected)
+        self.assertEqual(ledger.verify_cumulative(card), [])
+        self.assertEqual(card.departures.count(), 2)
+        self.assertTrue(get_user_model().objects.get(username='driver').check_password('driver'))
+        with self.assertRaises(CommandError):
+            call_command('copy_sqlite_database', source)
+
+
+class DepartureLockTest(CardsTestMixin, TestCase):
+    def test_retries_on_lock_conflict(self):
+        calls = list()
+
+        def write():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'ok'
+
+        with mock.patch.object(locking, 'LOCK_BACKOFF', 0), self.assertLogs('cards.locking', 'WARNING'):
+            self.assertEqual(locking.run_locked([self.card.pk], write), 'ok')
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_are_not_retried(self):
+        def write():
+            raise OperationalError('no such table')
+
+        with self.assertRaises(OperationalError):
+            locking.run_locked([self.card.pk], write)
+
+    def test_overlap_is_checked_again_under_lock(self):
+        self.client.force_login(self.user)
+        data = loadtest.slot_data(self.card, self.user, 3)
+        real_lock = locking.lock_cards
+
+        def lock_after_concurrent_insert(*card_ids):
+            # другой водитель успел записать выезд в тот же час после проверки формы
+            if not self.card.departures.exists():
+                self.add_departure(1, '06:00', '07:00')
+            real_lock(*card_ids)
+
+        with mock.patch.object(locking, 'lock_cards', lock_after_concurrent_insert):
+            response = self.client.post(reverse('departure_add', kwargs={'pk': self.card.pk}), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.card.departures.count(), 1)
+
@@ -21,11 +21,17 @@ urlpatterns = [
 
     path('report/<int:pk>/', views.ReportDetail.as_view(), name='report_detail'),
     path('report-choice/', views.ReportChoice.as_view(), name='report_choice'),
+    path('bulk-report/', views.BulkReport.as_view(), name='bulk_report'),
+    path('export/', views.Export.as_view(), name='export'),
+    path('export/departures/', views.DepartureExport.as_view(), name='departure_export'),
+    path('export/cards/', views.CardTotalExport.as_view(), name='card_total_export'),
 
     path('short-report/<int:pk>/', views.ShortReport.as_view(), name='short_report'),
     path('short-report_email/<int:pk>/', views.ShortReportEmail.as_view(), name='short_report_email'),
     path('full-report/<int:pk>/', views.FullReport.as_view(), name='full_report'),
     path('full-report_email/<int:pk>/', views.FullReportEmail.as_view(), name='full_report_email'),
+    path('report-job/<int:pk>/', views.ReportJobDetail.as_view(), name='report_job_detail'),
+    path('report-render-stats/', views.ReportRenderStats.as_view(), name='report_render_stats'),
 
     path('', views.home, name='home')
 ]
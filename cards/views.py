@@ -1,23 +1,32 @@
-from datetime import date, datetime
-from io import BytesIO
+from datetime import date
 
+from asgiref.sync import sync_to_async
 from django.contrib import messages
-from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.contrib.messages.views import SuccessMessageMixin
-from django.core.mail import EmailMessage
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
-from django.db.models import F, Sum, QuerySet
-from django.http import HttpResponse
-from django.shortcuts import render, get_object_or_404, redirect
-from django.template.loader import render_to_string
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse, FileResponse
+from django.shortcuts import render, get_object_or_404, redirect, aget_object_or_404
 from django.urls import reverse_lazy
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, quote_etag
 from django.views import View
 from django.views.generic import CreateView, ListView, DetailView, UpdateView, DeleteView, FormView
-from weasyprint import HTML, CSS
 
-from cards.forms import CardAddForm, DepartureAddForm, ReportEmailForm, ReportChoiceForm, NormAddForm
-from cards.models import Card, Departure, Norm
-from mixins import ErrorMessageMixin
+from cards import references, rendering
+from cards.exports import export_departures, export_card_totals, stream_csv, write_xlsx, XLSX_CONTENT_TYPE
+from cards.forms import CardAddForm, DepartureAddForm, ReportEmailForm, ReportChoiceForm, NormAddForm, BulkReportForm, \
+    ExportForm
+from cards.jobs import enqueue_report_email
+from cards.ledger import calculated_result
+from cards.locking import run_locked
+from cards.models import Card, Departure, Norm, ReportJob
+from cards.reports import report_key, report_cards, combined_report_pdf, combined_template, bulk_report_zip, \
+    aget_report_pdf
+from mixins import ErrorMessageMixin, AsyncLoginRequiredMixin
+from voditel.streaming import asgi_streaming
 
 
 def home(request):
@@ -45,31 +54,11 @@ class CardAdd(LoginRequiredMixin, SuccessMessageMixin, ErrorMessageMixin, Create
         return initial
 
 
-def calculated_result(card: Card) -> dict:
-    res: dict = card.departures. \
-        annotate(mileage_consumption=F('distance') * F('norm__liter_per_km'),
-                 with_pump_consumption=F('with_pump') * F('norm__work_with_pump_liter_per_min'),
-                 without_pump_consumption=F('without_pump') * F('norm__work_without_pump_liter_per_min')). \
-        aggregate(
-            total_distance=Sum('distance', default=0),
-            total_mileage_consumption=Sum('mileage_consumption', default=0),
-            total_time_with_pump=Sum('with_pump', default=0),
-            total_with_pump_consumption=Sum('with_pump_consumption', default=0),
-            total_time_without_pump=Sum('without_pump', default=0),
-            total_without_pump_consumption=Sum('without_pump_consumption', default=0),
-            total_refueled=Sum('refueled', default=0),
-            total_fuel_consumption=F('total_mileage_consumption') + F('total_with_pump_consumption') + F(
-                'total_without_pump_consumption'),
-            remaining_fuel=card.remaining_fuel + F('total_refueled') - F('total_fuel_consumption'),
-            current_mileage=card.mileage + F('total_distance'))
-
-    return res
-
-
 class CardDetail(LoginRequiredMixin, DetailView):
     model = Card
     template_name = 'cards/card_detail.html'
     context_object_name = 'card'
+    queryset = Card.objects.select_related('total')
 
     def get_context_data(self, **kwargs):
         ctx: dict = super().get_context_data(**kwargs)
@@ -78,17 +67,16 @@ class CardDetail(LoginRequiredMixin, DetailView):
         # добавил в контекст вычисленные данные
         ctx.update(calculated_result(self.object))
 
-        # для пагинации выездов
-        res = dict()
-        for item in self.object.departures.all():
-            if item.date not in res:
-                res[item.date] = []
-            res.get(item.date).append(item)
-        paginator = Paginator(list(res.values()), 7)
+        # пагинация по датам выездов, выбираются только выезды дат текущей страницы
+        dates = self.object.departures.order_by('-date').values_list('date', flat=True).distinct()
+        paginator = Paginator(dates, 7)
         page_obj = paginator.page(int(self.request.GET.get('page', 1)))
+        res = {day: [] for day in page_obj.object_list}
+        for item in self.object.departures.filter(date__in=list(res)):
+            res[item.date].append(item)
         ctx['paginator'] = paginator
         ctx['page_obj'] = page_obj
-        ctx['departures'] = page_obj.object_list
+        ctx['departures'] = list(res.values())
 
         return ctx
 
@@ -118,7 +106,38 @@ class CardDelete(PermissionRequiredMixin, LoginRequiredMixin, SuccessMessageMixi
     permission_required = 'cards.delete_card'
 
 
-class DepartureAdd(LoginRequiredMixin, SuccessMessageMixin, ErrorMessageMixin, CreateView):
+class DepartureLockMixin:
+    # добавление, изменение и удаление выездов идут в транзакции с блокировкой карточки:
+    # пересечение по времени проверяется еще раз под блокировкой, при конфликте запись повторяется
+    def get_locked_card_ids(self, form):
+        card = form.cleaned_data.get('card') if hasattr(form, 'cleaned_data') else None
+        ids = {card.pk} if card else set()
+        if getattr(self, 'object', None) is not None:
+            ids.add(self.object.card_id)
+        return ids
+
+    def form_valid(self, form):
+        instance = getattr(form, 'instance', None)
+        adding = instance is not None and instance._state.adding
+
+        def write():
+            if adding:
+                # после отката неудачной попытки выезд снова новый
+                instance.pk = None
+                instance._state.adding = True
+            if isinstance(form, DepartureAddForm):
+                try:
+                    form.check_overlap()
+                except ValidationError as e:
+                    form.add_error(None, e)
+                    return None
+            return super(DepartureLockMixin, self).form_valid(form)
+
+        response = run_locked(self.get_locked_card_ids(form), write)
+        return response if response is not None else self.form_invalid(form)
+
+
+class DepartureAdd(LoginRequiredMixin, DepartureLockMixin, SuccessMessageMixin, ErrorMessageMixin, CreateView):
     form_class = DepartureAddForm
     template_name = 'cards/departure_add.html'
     success_message = "Выезд добавлен"
@@ -128,7 +147,7 @@ class DepartureAdd(LoginRequiredMixin, SuccessMessageMixin, ErrorMessageMixin, C
         return reverse_lazy('card_detail', kwargs={'pk': self.card.id})
 
     def setup(self, request, *args, **kwargs):
-        self.card = get_object_or_404(Card, pk=kwargs['pk'])
+        self.card = get_object_or_404(Card.objects.select_related('total'), pk=kwargs['pk'])
         super().setup(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
@@ -168,48 +187,21 @@ class DepartureDetail(LoginRequiredMixin, DetailView):
     template_name = 'cards/departure_detail.html'
     context_object_name = 'departure'
 
+    queryset = Departure.objects.select_related('user')
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        # все выезды в данной карточке
-        departures: QuerySet = self.object.card.departures.all()
-
-        # все выезды завершенные до данного выезда
-        departures_before = list(filter(
-            lambda a: datetime.combine(a.date, a.return_time) <
-                      datetime.combine(self.object.date, self.object.return_time),
-            departures))
-        # общий пробег всех выездов до данного выезда
-        total_distance = 0
-        if departures_before:
-            for departure in departures_before:
-                if departure.distance:
-                    total_distance += departure.distance
-
-        # пробег до выезда
-        mileage_start = self.object.card.mileage + total_distance
-
-        # пробег после выезда
-        if self.object.distance:
-            mileage_end = mileage_start + self.object.distance
-        else:
-            mileage_end = mileage_start
-
-        # топливо израсходовано за выезд
-        fuel_consumption = 0
-        if self.object.distance:
-            fuel_consumption += self.object.distance * self.object.norm.liter_per_km
-        if self.object.with_pump:
-            fuel_consumption += self.object.with_pump * self.object.norm.work_with_pump_liter_per_min
-        if self.object.without_pump:
-            fuel_consumption += self.object.without_pump * self.object.norm.work_without_pump_liter_per_min
+        # нарастающий итог хранится в выезде, пробег до выезда без просмотра остальных выездов
+        distance = self.object.distance or 0
+        mileage_start = self.object.card.mileage + self.object.cumulative_distance - distance
 
         ctx['mileage_start'] = mileage_start
-        ctx['mileage_end'] = mileage_end
-        ctx['fuel_consumption'] = fuel_consumption
+        ctx['mileage_end'] = mileage_start + distance
+        ctx['fuel_consumption'] = self.object.fuel_consumption
         return ctx
 
 
-class DepartureDelete(LoginRequiredMixin, SuccessMessageMixin, DeleteView):
+class DepartureDelete(LoginRequiredMixin, DepartureLockMixin, SuccessMessageMixin, DeleteView):
     model = Departure
     success_message = "Выезд удален"
 
@@ -217,7 +209,7 @@ class DepartureDelete(LoginRequiredMixin, SuccessMessageMixin, DeleteView):
         return reverse_lazy("card_detail", kwargs={'pk': self.object.card.pk})
 
 
-class DepartureUpdate(LoginRequiredMixin, SuccessMessageMixin, ErrorMessageMixin, UpdateView):
+class DepartureUpdate(LoginRequiredMixin, DepartureLockMixin, SuccessMessageMixin, ErrorMessageMixin, UpdateView):
     model = Departure
     form_class = DepartureAddForm
     success_message = "Данные изменены"
@@ -245,6 +237,9 @@ class NormList(LoginRequiredMixin, ListView):
     extra_context = {'title': 'Нормы'}
     context_object_name = 'norms'
 
+    def get_queryset(self):
+        return references.norms.all()
+
 
 class NormAdd(LoginRequiredMixin, SuccessMessageMixin, ErrorMessageMixin, CreateView):
     form_class = NormAddForm
@@ -273,6 +268,7 @@ class NormUpdate(LoginRequiredMixin, SuccessMessageMixin, ErrorMessageMixin, Upd
 
 class ReportDetail(LoginRequiredMixin, DetailView):
     model = Card
+    queryset = Card.objects.select_related('total')
     template_name = 'cards/report_detail.html'
     context_object_name = 'report'
 
@@ -285,97 +281,73 @@ class ReportDetail(LoginRequiredMixin, DetailView):
         return ctx
 
 
-def convert_html_to_pdf_stream(template: str, context: dict) -> BytesIO:
-    html_content = render_to_string(template, context)
-    memory_buffer = BytesIO()
-    pdf = HTML(string=html_content).write_pdf(target=memory_buffer, stylesheets=[CSS(string='@page {size: landscape}')])
-
-    return memory_buffer
-
+class CardReportPdf(AsyncLoginRequiredMixin, View):
+    # pdf отчет по карточке, рендер в пуле потоков (cards.reports.aget_report_pdf);
+    # etag - версия карточки, при совпадении отвечает 304 без рендера
+    template = None
 
-class FullReport(LoginRequiredMixin, View):
-    def get(self, request, *args, **kwargs):
-        card = Card.objects.get(pk=kwargs.get('pk'))
-
-        report_data = calculated_result(card)
-        report_data['card'] = card
-
-        pdf_stream = convert_html_to_pdf_stream('cards/full_report_pdf.html', report_data)
-        response = HttpResponse(pdf_stream.getvalue(), content_type='application/pdf')
+    async def get(self, request, *args, **kwargs):
+        card = await aget_object_or_404(Card.objects.select_related('total'), pk=kwargs.get('pk'))
+        etag = quote_etag(report_key(self.template, [(card.pk, card.version)]))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            pdf = await aget_report_pdf(self.template, [card])
+            response = HttpResponse(pdf, content_type='application/pdf')
+        response.headers.setdefault('ETag', etag)
         return response
 
 
-class ShortReport(LoginRequiredMixin, View):
-    def get(self, request, *args, **kwargs):
-        card = Card.objects.get(pk=kwargs.get('pk'))
+class FullReport(CardReportPdf):
+    template = 'cards/full_report_pdf.html'
 
-        report_data = calculated_result(card)
-        report_data['card'] = card
 
-        pdf_stream = convert_html_to_pdf_stream('cards/short_report_pdf.html', report_data)
-        response = HttpResponse(pdf_stream.getvalue(), content_type='application/pdf')
-        return response
+class ShortReport(CardReportPdf):
+    template = 'cards/short_report_pdf.html'
 
 
 class FullReportEmail(LoginRequiredMixin, SuccessMessageMixin, ErrorMessageMixin, FormView):
     template_name = 'cards/report_email.html'
-    success_message = "Email отправлен"
+    success_message = "Отчет поставлен в очередь на отправку"
     error_message = 'Ошибка!'
     form_class = ReportEmailForm
     extra_context = {'title': 'Полный отчет на email'}
 
     def get_success_url(self):
-        return reverse_lazy('card_detail', kwargs={'pk': self.kwargs.get('pk')})
+        return self.job.get_absolute_url()
 
     def setup(self, request, *args, **kwargs):
         self.card = get_object_or_404(Card, pk=kwargs['pk'])
-        report_data = calculated_result(self.card)
-        report_data['card'] = self.card
-        self.pdf_stream = convert_html_to_pdf_stream('cards/full_report_pdf.html', report_data)
         super().setup(request, *args, **kwargs)
 
     def form_valid(self, form):
-        email = EmailMessage(
-            subject=f'Отчет {self.card}',
-            body='Отчет находится в прикрепленном файле',
-            from_email='zvovan77@yandex.ru',
-            to=[form.cleaned_data.get("email")]
-        )
-        email.attach(f"отчет-{self.card.truck.name}-{self.card.month.month}-{self.card.month.year}.pdf", self.pdf_stream.getvalue())
-        email.send()
+        # pdf формируется и отправляется обработчиком очереди (run_report_jobs)
+        self.job = enqueue_report_email('cards/full_report_pdf.html', [self.card],
+                                        form.cleaned_data.get("email"), self.request.user)
         return super().form_valid(form)
 
 
 class ShortReportEmail(LoginRequiredMixin, SuccessMessageMixin, ErrorMessageMixin, FormView):
     template_name = 'cards/report_email.html'
-    success_message = "Email отправлен"
+    success_message = "Отчет поставлен в очередь на отправку"
     error_message = 'Ошибка!'
     form_class = ReportEmailForm
     extra_context = {'title': 'Короткий отчет на email'}
 
     def get_success_url(self):
-        return reverse_lazy('card_detail', kwargs={'pk': self.kwargs.get('pk')})
+        return self.job.get_absolute_url()
 
     def setup(self, request, *args, **kwargs):
         self.card = get_object_or_404(Card, pk=kwargs['pk'])
-        report_data = calculated_result(self.card)
-        report_data['card'] = self.card
-        self.pdf_stream = convert_html_to_pdf_stream('cards/short_report_pdf.html', report_data)
         super().setup(request, *args, **kwargs)
 
     def form_valid(self, form):
-        email = EmailMessage(
-            subject=f'Отчет {self.card}',
-            body='Отчет находится в прикрепленном файле',
-            from_email='zvovan77@yandex.ru',
-            to=[form.cleaned_data.get("email")]
-        )
-        email.attach(f"отчет-{self.card.truck.name}-{self.card.month.month}-{self.card.month.year}.pdf", self.pdf_stream.getvalue())
-        email.send()
+        # pdf формируется и отправляется обработчиком очереди (run_report_jobs)
+        self.job = enqueue_report_email('cards/short_report_pdf.html', [self.card],
+                                        form.cleaned_data.get("email"), self.request.user)
         return super().form_valid(form)
 
 
-class ReportChoice(LoginRequiredMixin, FormView):
+class ReportChoice(AsyncLoginRequiredMixin, FormView):
     template_name = 'cards/report_choice.html'
     form_class = ReportChoiceForm
     extra_context = {'title': 'Выбор периода'}
@@ -391,43 +363,128 @@ class ReportChoice(LoginRequiredMixin, FormView):
         initial['year'] = date.today().year
         return initial
 
-    def form_valid(self, form):
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(super().get)(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        if not form.is_valid():
+            return self.form_invalid(form)
+        return await self.form_valid(form)
+
+    async def put(self, *args, **kwargs):
+        return await self.post(*args, **kwargs)
+
+    async def form_valid(self, form):
         cd = form.cleaned_data
-        cards = Card.objects.filter(month__year=cd.get('year'), month__month=cd.get('month'))
+        cards = [card async for card in report_cards(year=int(cd.get('year')), month=int(cd.get('month')))]
         if not cards:
             messages.warning(self.request, 'Нет карточек за этот период')
             return redirect(reverse_lazy('report_choice'))
         elif len(cards) == 1:
             self.card = cards[0]
-            report_data = calculated_result(cards[0])
-            report_data['card'] = cards[0]
-            pdf_stream = convert_html_to_pdf_stream('cards/short_report_pdf.html', report_data)
         else:
             self.cards = cards
-            reports_data = list()
-            for card in cards:
-                report_data = calculated_result(card)
-                report_data['card'] = card
-                reports_data.append(report_data)
-            pdf_stream = convert_html_to_pdf_stream('cards/short_reports_pdf.html', {'data': reports_data})
-
-        # если есть значение в поле email отправляем письмо по введенному адресу
+        template = combined_template(cards)
+        pdf = await aget_report_pdf(template, cards)
+
+        # если есть значение в поле email ставим отправку письма в очередь
         if cd.get('email'):
-            email = EmailMessage(
-                body='Отчет находится в прикрепленном файле',
-                from_email='zvovan77@yandex.ru',
-                to=[cd.get("email")]
-            )
-            if self.card:
-                email.subject = f'Отчет {self.card}'
-                email.attach(f"отчет-{self.card.truck.name}-{self.card.month.month}-{self.card.month.year}.pdf",
-                             pdf_stream.getvalue())
-            elif self.cards:
-                email.subject = f'Отчет {self.cards[0].truck.name} и {self.cards[1]}'
-                email.attach(f"отчет-{self.cards[0].truck.name}-{self.cards[1].truck.name}-{self.cards[0].month.month}-{self.cards[0].month.year}.pdf",
-                             pdf_stream.getvalue())
-
-            email.send()
-
-        response = HttpResponse(pdf_stream.getvalue(), content_type='application/pdf')
+            job = await sync_to_async(enqueue_report_email)(template, cards, cd.get('email'),
+                                                            await self.request.auser())
+            messages.success(self.request, f'Отчет поставлен в очередь на отправку (задача {job.pk})')
+
+        response = HttpResponse(pdf, content_type='application/pdf')
+        return response
+
+
+class ReportRenderStats(LoginRequiredMixin, UserPassesTestMixin, View):
+    # счетчики пула рендера pdf этого процесса
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({'enabled': bool(settings.REPORT_RENDER_POOL), **rendering.render_pool().stats()})
+
+
+class BulkReport(LoginRequiredMixin, FormView):
+    template_name = 'cards/bulk_report.html'
+    form_class = BulkReportForm
+    extra_context = {'title': 'Выгрузка отчетов'}
+
+    def get_initial(self):
+        initial = super().get_initial()
+        initial['month'] = date.today().month
+        initial['year'] = date.today().year
+        return initial
+
+    def form_valid(self, form):
+        cd = form.cleaned_data
+        cards = list(report_cards(year=cd.get('year'), month=cd.get('month'), truck=cd.get('truck')))
+        if not cards:
+            messages.warning(self.request, 'Нет карточек за этот период')
+            return redirect(reverse_lazy('bulk_report'))
+
+        period = f"{cd.get('month')}-{cd.get('year')}" if cd.get('month') else f"{cd.get('year')}"
+        if cd.get('format') == 'zip':
+            response = HttpResponse(bulk_report_zip(cards, cd.get('template')), content_type='application/zip')
+            response['Content-Disposition'] = content_disposition_header(True, f'отчеты-{period}.zip')
+        else:
+            response = HttpResponse(combined_report_pdf(cards), content_type='application/pdf')
+            response['Content-Disposition'] = content_disposition_header(False, f'отчеты-{period}.pdf')
         return response
+
+
+class Export(LoginRequiredMixin, FormView):
+    template_name = 'cards/export.html'
+    form_class = ExportForm
+    extra_context = {'title': 'Выгрузка в csv и xlsx'}
+
+    def get_initial(self):
+        initial = super().get_initial()
+        initial['date_from'] = date(date.today().year, 1, 1)
+        initial['date_to'] = date.today()
+        return initial
+
+
+class ExportFile(LoginRequiredMixin, View):
+    # csv идет потоком, строки читаются из базы порциями; xlsx собирается во временном файле
+    export = None
+    filename = ''
+
+    def get(self, request, *args, **kwargs):
+        form = ExportForm(request.GET)
+        if not form.is_valid():
+            messages.error(request, 'Ошибка!')
+            return redirect(reverse_lazy('export'))
+        cd = form.cleaned_data
+        header, rows = self.export(cd.get('date_from'), cd.get('date_to'), cd.get('truck'))
+        filename = f"{self.filename}-{cd.get('date_from')}-{cd.get('date_to')}"
+        if cd.get('file_format') == 'xlsx':
+            response = FileResponse(write_xlsx(header, rows), as_attachment=True, filename=f'{filename}.xlsx',
+                                    content_type=XLSX_CONTENT_TYPE)
+        else:
+            response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = content_disposition_header(True, f'{filename}.csv')
+        return asgi_streaming(request, response)
+
+
+class DepartureExport(ExportFile):
+    export = staticmethod(export_departures)
+    filename = 'выезды'
+
+
+class CardTotalExport(ExportFile):
+    export = staticmethod(export_card_totals)
+    filename = 'итоги'
+
+
+class ReportJobDetail(LoginRequiredMixin, DetailView):
+    model = ReportJob
+    template_name = 'cards/report_job_detail.html'
+    context_object_name = 'job'
+    extra_context = {'title': 'Отправка отчета'}
+
+    def get_queryset(self):
+        # в задаче email получателя: чужие задачи не показываются
+        return super().get_queryset().filter(user=self.request.user)
@@ -1,4 +1,7 @@
 from django.contrib import messages
+from django.contrib.auth.mixins import AccessMixin
+from django.contrib.auth.views import redirect_to_login
+
 
 class ErrorMessageMixin:
 
@@ -12,4 +15,14 @@ class ErrorMessageMixin:
         return response
 
     def get_error_message(self, cleaned_data):
-        return self.error_message % cleaned_data
\ No newline at end of file
+        return self.error_message % cleaned_data
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    # LoginRequiredMixin для async view: пользователь читается через request.auser(),
+    # синхронный request.user в цикле событий обращаться к базе не может
+    async def dispatch(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), self.get_login_url(), self.get_redirect_field_name())
+        return await super().dispatch(request, *args, **kwargs)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ShareFileConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'share_file'
+
+    def ready(self):
+        from share_file import signals  # noqa: F401
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from share_file import uploads
+from share_file.models import Upload
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные загрузки по частям вместе с их файлами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.SHARE_FILE_UPLOAD_EXPIRE_HOURS,
+                            help='загрузки, начатые раньше стольких часов назад')
+
+    def handle(self, *args, **options):
+        expired = Upload.objects.filter(created__lt=timezone.now() - timedelta(hours=options['hours']))
+        count = 0
+        for upload in expired:
+            uploads.discard_upload(upload)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено загрузок: {count}'))
@@ -0,0 +1,51 @@
+import hashlib
+import os
+
+from django.core.files import File as DjangoFile
+from django.core.management.base import BaseCommand
+
+from share_file.models import File, Blob
+from share_file.storage import BLOBS_DIR, HASH_BLOCK_SIZE
+
+
+def file_digest(storage, name: str) -> str:
+    digest = hashlib.sha256()
+    with storage.open(name, 'rb') as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = 'Переносит файлы из media/files в хранилище по содержимому (blobs): одинаковые файлы - в один blob'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='только посчитать, сколько места освободится')
+
+    def handle(self, *args, **options):
+        moved = missing = freed = 0
+        blobs = set(Blob.objects.values_list('name', flat=True))
+        for file in File.objects.exclude(file__startswith=f'{BLOBS_DIR}/').order_by('pk'):
+            storage = file.file.storage
+            old_name = file.file.name
+            if not storage.exists(old_name):
+                missing += 1
+                self.stderr.write(f'Нет файла {old_name} (File {file.pk})')
+                continue
+            size = storage.size(old_name)
+            if options['dry_run']:
+                new_name = storage.blob_name(file_digest(storage, old_name), old_name)
+            else:
+                with storage.open(old_name, 'rb') as content:
+                    new_name = storage.save(old_name, DjangoFile(content))
+                file.name = file.name or os.path.basename(old_name)
+                file.file.name = new_name
+                file.save(update_fields=['file', 'name'])
+                storage.delete(old_name)
+            if new_name in blobs:
+                freed += size
+            blobs.add(new_name)
+            moved += 1
+
+        message = f'Файлов: {moved}, нет на диске: {missing}, освобождается байт: {freed}'
+        self.stdout.write(message if options['dry_run'] else self.style.SUCCESS(message))
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:47
+
+import os
+
+import share_file.storage
+from django.db import migrations, models
+
+
+def fill_file_names(apps, schema_editor):
+    # имя для показа - прежнее имя файла в files/
+    File = apps.get_model('share_file', 'File')
+    for file in File.objects.filter(name=''):
+        file.name = os.path.basename(file.file.name)
+        file.save(update_fields=['name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('share_file', '0002_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Путь')),
+                ('size', models.BigIntegerField(verbose_name='Размер')),
+                ('refs', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='name',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Имя файла'),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(db_index=True, storage=share_file.storage.blob_storage, upload_to='files'),
+        ),
+        migrations.RunPython(fill_file_names, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,41 @@
+import os
+import uuid
+
 from django.db import models
 
+from share_file.storage import blob_storage
+
+
 class File(models.Model):
-    file = models.FileField(upload_to='files')
+    # file - общий для одинаковых файлов blob (share_file.storage), name - имя, под которым файл загрузили
+    file = models.FileField(upload_to='files', storage=blob_storage, db_index=True)
+    name = models.CharField(max_length=255, blank=True, verbose_name='Имя файла')
+
+    def __str__(self):
+        return self.name or os.path.basename(self.file.name)
+
+    def save(self, *args, **kwargs):
+        if not self.name and self.file and not self.file._committed:
+            self.name = os.path.basename(self.file.name)
+        super().save(*args, **kwargs)
+
+
+class Blob(models.Model):
+    # файл в хранилище и число ссылающихся на него File
+    name = models.CharField(max_length=255, unique=True, verbose_name='Путь')
+    size = models.BigIntegerField(verbose_name='Размер')
+    refs = models.PositiveIntegerField(default=0, verbose_name='Ссылок')
+
+    def __str__(self):
+        return self.name
+
+
+class Upload(models.Model):
+    # незавершенная загрузка по частям (share_file.uploads), смещение - размер файла части на диске
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255, verbose_name='Имя файла')
+    size = models.BigIntegerField(verbose_name='Размер')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='Начата')
 
     def __str__(self):
-        return self.file.name.split('/')[-1]
+        return self.filename
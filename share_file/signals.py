@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from share_file.models import File
+
+
+@receiver(post_delete, sender=File)
+def release_blob(sender, instance, **kwargs):
+    if instance.file:
+        instance.file.storage.release(instance.file.name)
@@ -0,0 +1,116 @@
+// загрузка файлов формы по частям (share_file.uploads): каждая часть - отдельный запрос,
+// после обрыва связи или перезагрузки страницы загрузка продолжается с последнего принятого байта;
+// без fetch/Blob.slice форма отправляется как обычно
+(function () {
+    var form = document.querySelector('form[data-upload-url]');
+    if (!form || !window.fetch || !window.Blob || !Blob.prototype.slice) {
+        return;
+    }
+    var input = form.querySelector('input[type=file]');
+    var progress = document.getElementById('upload-progress');
+    var bar = progress.querySelector('.progress-bar');
+    var chunkSize = parseInt(form.dataset.chunkSize, 10);
+    var csrfToken = form.querySelector('[name=csrfmiddlewaretoken]').value;
+    var retries = 5;
+
+    function storageKey(file) {
+        return 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+    }
+
+    function request(url, options) {
+        options.headers = Object.assign({'X-CSRFToken': csrfToken}, options.headers || {});
+        options.credentials = 'same-origin';
+        return fetch(url, options).then(function (response) {
+            return response.json().catch(function () {
+                return {};
+            }).then(function (data) {
+                data.status = response.status;
+                return data;
+            });
+        });
+    }
+
+    function start(file) {
+        var saved = localStorage.getItem(storageKey(file));
+        if (saved) {
+            return request(saved, {method: 'GET'}).then(function (state) {
+                return state.status === 200 ? state : create(file);
+            });
+        }
+        return create(file);
+    }
+
+    function create(file) {
+        var data = new FormData();
+        data.append('filename', file.name);
+        data.append('size', file.size);
+        return request(form.dataset.uploadUrl, {method: 'POST', body: data}).then(function (state) {
+            if (state.status !== 201) {
+                throw new Error(state.error || 'Не удалось начать загрузку');
+            }
+            localStorage.setItem(storageKey(file), state.url);
+            return state;
+        });
+    }
+
+    function sendChunks(file, state, done, total, attempt) {
+        if (state.file) {
+            localStorage.removeItem(storageKey(file));
+            return Promise.resolve();
+        }
+        var chunk = file.slice(state.offset, state.offset + chunkSize);
+        return request(state.url, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/octet-stream', 'Upload-Offset': String(state.offset)},
+            body: chunk
+        }).then(function (next) {
+            if (next.status === 200 || next.status === 409) {
+                // 409 - сервер уже принял часть раньше: продолжаем с его смещения
+                bar.style.width = Math.round((done + next.offset) / total * 100) + '%';
+                return sendChunks(file, next, done, total, 0);
+            }
+            throw new Error(next.error || 'Ошибка загрузки');
+        }, function (error) {
+            if (attempt >= retries) {
+                throw error;
+            }
+            return new Promise(function (resolve) {
+                setTimeout(resolve, 1000 * Math.pow(2, attempt));
+            }).then(function () {
+                return request(state.url, {method: 'GET'});
+            }).then(function (current) {
+                return sendChunks(file, current, done, total, attempt + 1);
+            }, function () {
+                return sendChunks(file, state, done, total, attempt + 1);
+            });
+        });
+    }
+
+    form.addEventListener('submit', function (event) {
+        var files = Array.prototype.slice.call(input.files);
+        if (!files.length) {
+            return;
+        }
+        event.preventDefault();
+        var total = files.reduce(function (sum, file) {
+            return sum + file.size;
+        }, 0) || 1;
+        var done = 0;
+        form.querySelector('button[type=submit]').disabled = true;
+        progress.classList.remove('d-none');
+        files.reduce(function (chain, file) {
+            return chain.then(function () {
+                return start(file).then(function (state) {
+                    return sendChunks(file, state, done, total, 0);
+                }).then(function () {
+                    done += file.size;
+                });
+            });
+        }, Promise.resolve()).then(function () {
+            window.location.reload();
+        }, function (error) {
+            form.querySelector('button[type=submit]').disabled = false;
+            form.querySelector('.form-text').textContent = error.message;
+        });
+    });
+})();
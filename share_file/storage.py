@@ -0,0 +1,95 @@
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+BLOBS_DIR = 'blobs'
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # имя файла в хранилище - sha256 содержимого (blobs/ab/<sha256>.<расширение>): одинаковые файлы
+    # лежат на диске один раз; на каждый файл ведется счетчик ссылок share_file.models.Blob,
+    # физически файл удаляет release() последней ссылки
+
+    def blob_name(self, digest: str, name: str) -> str:
+        extension = os.path.splitext(name)[1].lower()[:10]
+        return f'{BLOBS_DIR}/{digest[:2]}/{digest}{extension}'
+
+    def stage(self, content) -> tuple:
+        # sha256 считается во время записи во временный файл рядом с blobs (тот же диск - rename);
+        # файл загрузки по частям уже лежит в MEDIA_ROOT и только читается; временный файл большого
+        # multipart-upload лежит в /tmp (в docker-compose другой том, rename падает с EXDEV) - копируется
+        from share_file.uploads import PartFile
+
+        if isinstance(content, PartFile):
+            digest = hashlib.sha256()
+            with open(content.temporary_file_path(), 'rb') as f:
+                while block := f.read(HASH_BLOCK_SIZE):
+                    digest.update(block)
+            return digest.hexdigest(), content.temporary_file_path()
+
+        directory = self.path(BLOBS_DIR)
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+            for block in content.chunks(HASH_BLOCK_SIZE):
+                digest.update(block)
+                f.write(block)
+        return digest.hexdigest(), f.name
+
+    def _save(self, name, content):
+        digest, staged = self.stage(content)
+        name = self.blob_name(digest, name)
+        path = self.path(name)
+        blob_model = apps.get_model('share_file', 'Blob')
+        # блокировка строки Blob: release() не удалит файл между проверкой и новой ссылкой
+        with transaction.atomic():
+            blob, created = blob_model.objects.select_for_update().get_or_create(
+                name=name, defaults={'size': os.path.getsize(staged)})
+            if os.path.exists(path):
+                os.remove(staged)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(staged, path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+            blob_model.objects.filter(pk=blob.pk).update(refs=F('refs') + 1)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # одинаковое имя означает одинаковое содержимое, суффиксы не нужны
+        return name
+
+    def release(self, name: str) -> None:
+        # файл удаляется только после коммита: при откате записи File и Blob остаются вместе с файлом
+        blob_model = apps.get_model('share_file', 'Blob')
+        with transaction.atomic():
+            blob = blob_model.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                # файл из files/, еще не перенесенный командой dedupe_files, ни с кем не общий
+                if not name.startswith(f'{BLOBS_DIR}/'):
+                    transaction.on_commit(lambda: self.delete(name))
+                return
+            blob_model.objects.filter(pk=blob.pk).update(refs=F('refs') - 1)
+            if blob.refs == 1:
+                transaction.on_commit(lambda: self.delete_unreferenced(name))
+
+    def delete_unreferenced(self, name: str) -> None:
+        # запись Blob с refs=0 удаляется вместе с файлом под ее блокировкой: _save, взявший тот же
+        # файл после коммита release(), либо успел поднять refs (файл остается), либо ждет блокировку
+        # и после удаления записи кладет файл заново
+        blob_model = apps.get_model('share_file', 'Blob')
+        with transaction.atomic():
+            blob = blob_model.objects.select_for_update().filter(name=name, refs=0).first()
+            if blob is not None:
+                blob.delete()
+                self.delete(name)
+
+
+def blob_storage() -> ContentAddressedStorage:
+    return ContentAddressedStorage()
@@ -1,3 +1,241 @@
-from django.test import TestCase
+import errno
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from share_file import uploads
+from share_file.models import File, Upload, Blob
+
+
+class ChunkedUploadTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='driver', password='pass')
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, SHARE_FILE_CHUNK_SIZE=4)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+
+    def start(self, filename='отчет.txt', size=10):
+        response = self.client.post(reverse('share_file:upload_start'), {'filename': filename, 'size': size})
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def send(self, state, data, offset=None):
+        return self.client.post(state['url'], data, content_type='application/octet-stream',
+                                headers={'Upload-Offset': str(state['offset'] if offset is None else offset)})
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.post(reverse('share_file:upload_start'), {'filename': 'a.txt', 'size': 10})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(self.client.get(reverse('share_file:file_add')).status_code, 302)
+
+    def test_upload_in_chunks_with_resume(self):
+        state = self.start()
+        state = self.send(state, b'0123').json()
+        self.assertEqual(state['offset'], 4)
+
+        # повтор уже принятой части после обрыва связи: сервер называет свое смещение
+        response = self.send(state, b'0123', offset=0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 4)
+
+        state = self.client.get(state['url']).json()
+        self.assertEqual(state['offset'], 4)
+        state = self.send(state, b'4567').json()
+        self.assertFalse(File.objects.exists())
+        state = self.send(state, b'89').json()
+
+        file = File.objects.get(pk=state['file'])
+        self.assertEqual(str(file), 'отчет.txt')
+        with file.file.open('rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(os.listdir(uploads.parts_dir()), [])
+
+    def test_rejects_oversized_chunks(self):
+        state = self.start(size=6)
+        self.assertEqual(self.send(state, b'01234').status_code, 400)
+        state = self.send(state, b'0123').json()
+        self.assertEqual(self.send(state, b'456').status_code, 400)
+        self.assertEqual(self.client.get(state['url']).json()['offset'], 4)
+
+    def test_empty_file(self):
+        state = self.start(size=0)
+        state = self.send(state, b'').json()
+        self.assertEqual(File.objects.get(pk=state['file']).file.size, 0)
+
+    def test_clear_stale_uploads(self):
+        state = self.start()
+        self.send(state, b'0123')
+        Upload.objects.update(created=Upload.objects.get().created - timedelta(days=2))
+        call_command('clear_uploads', stdout=StringIO())
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(os.listdir(uploads.parts_dir()), [])
+
+
+class BlobStorageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='driver', password='pass')
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+
+    def upload(self, name, content):
+        self.client.post(reverse('share_file:file_add'), {'file_field': [SimpleUploadedFile(name, content)]})
+        return File.objects.latest('pk')
+
+    def test_same_content_stored_once(self):
+        first = self.upload('отчет.pdf', b'%PDF report')
+        second = self.upload('копия.pdf', b'%PDF report')
+        other = self.upload('другой.pdf', b'%PDF other')
+        self.assertEqual((str(first), str(second)), ('отчет.pdf', 'копия.pdf'))
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.file.name, other.file.name)
+        self.assertTrue(first.file.name.startswith('blobs/'))
+        self.assertEqual(Blob.objects.get(name=first.file.name).refs, 2)
+        path = first.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('share_file:file_delete', kwargs={'pk': first.pk}))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get(name=second.file.name).refs, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('share_file:file_delete', kwargs={'pk': second.pk}))
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.filter(name=second.file.name).exists())
+
+    def test_large_form_upload_copied_from_temp_dir(self):
+        # большой файл формы лежит во временном каталоге на другом томе: rename оттуда падает с EXDEV
+        upload_temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_temp_dir)
+        replace = os.replace
+
+        def same_volume_replace(src, dst):
+            if not os.path.abspath(src).startswith(self.media_root):
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            replace(src, dst)
+
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0, FILE_UPLOAD_TEMP_DIR=upload_temp_dir), \
+                mock.patch('share_file.storage.os.replace', same_volume_replace):
+            file = self.upload('отчет.pdf', b'%PDF large report')
+        self.assertTrue(file.file.name.startswith('blobs/'))
+        with file.file.open('rb') as f:
+            self.assertEqual(f.read(), b'%PDF large report')
+        self.assertEqual(os.listdir(upload_temp_dir), [])
+
+    def test_file_kept_when_delete_rolls_back(self):
+        file = self.upload('отчет.pdf', b'%PDF report')
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            file.delete()
+            raise RuntimeError
+        self.assertTrue(os.path.exists(file.file.path))
+        self.assertEqual(Blob.objects.get(name=file.file.name).refs, 1)
+
+    def test_unreferenced_blob_reused_before_cleanup(self):
+        first = self.upload('отчет.pdf', b'%PDF report')
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        second = self.upload('копия.pdf', b'%PDF report')
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(second.file.path))
+        self.assertEqual(Blob.objects.get(name=second.file.name).refs, 1)
+
+    def test_dedupe_existing_files(self):
+        os.makedirs(os.path.join(self.media_root, 'files'))
+        for name in ('a.pdf', 'b.pdf', 'c.pdf'):
+            with open(os.path.join(self.media_root, 'files', name), 'wb') as f:
+                f.write(b'same' if name != 'c.pdf' else b'other')
+            File.objects.bulk_create([File(file=f'files/{name}', name=name)])
+
+        out = StringIO()
+        call_command('dedupe_files', '--dry-run', stdout=out)
+        self.assertIn('освобождается байт: 4', out.getvalue())
+        self.assertFalse(Blob.objects.exists())
+
+        call_command('dedupe_files', stdout=out)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'files')), [])
+        self.assertEqual(File.objects.values('file').distinct().count(), 2)
+        self.assertEqual(sorted(Blob.objects.values_list('refs', flat=True)), [1, 2])
+        with File.objects.get(name='b.pdf').file.open('rb') as f:
+            self.assertEqual(f.read(), b'same')
+
+
+class FileDownloadTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='driver', password='pass')
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.file = File(name='отчет.pdf')
+        self.file.file.save('отчет.pdf', ContentFile(b'0123456789'))
+        self.url = reverse('share_file:file_download', kwargs={'pk': self.file.pk})
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_login_required(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_file_response_with_ranges(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(self.content(response), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn("filename*=utf-8''", response['Content-Disposition'])
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.content(response), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(self.content(self.client.get(self.url, headers={'Range': 'bytes=-3'})), b'789')
+        self.assertEqual(self.content(self.client.get(self.url, headers={'Range': 'bytes=8-'})), b'89')
+        self.assertEqual(self.client.get(self.url, headers={'Range': 'bytes=20-'}).status_code, 416)
+
+        response = self.client.get(self.url, headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_range_streamed_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url, headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([part async for part in response.streaming_content]), b'2345')
+
+    @override_settings(MEDIA_ACCEL_REDIRECT=True)
+    def test_accel_redirect(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.file.file.name)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response.content, b'')
@@ -0,0 +1,112 @@
+import fcntl
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+
+from share_file.models import File, Upload
+
+# загрузка по частям: части дописываются в MEDIA_ROOT/<SHARE_FILE_PARTS_DIR>/<id>.part, смещение
+# загрузки - размер этого файла; после последней части файл переносится в хранилище (rename)
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadConflict(UploadError):
+    # часть пришла не с того смещения или загрузку сейчас пишет другой запрос
+    def __init__(self, offset: int):
+        super().__init__(f'Ожидается часть со смещения {offset}')
+        self.offset = offset
+
+
+class PartFile(DjangoFile):
+    # FileSystemStorage переносит файл с temporary_file_path() в хранилище через os.rename, без копирования
+    def temporary_file_path(self) -> str:
+        return self.file.name
+
+
+def parts_dir() -> str:
+    return os.path.join(os.path.abspath(settings.MEDIA_ROOT), settings.SHARE_FILE_PARTS_DIR)
+
+
+def part_path(upload: Upload) -> str:
+    return os.path.join(parts_dir(), f'{upload.pk}.part')
+
+
+def upload_offset(upload: Upload) -> int:
+    try:
+        return os.path.getsize(part_path(upload))
+    except FileNotFoundError:
+        return 0
+
+
+def start_upload(filename: str, size: int) -> Upload:
+    if size < 0 or size > settings.SHARE_FILE_MAX_SIZE:
+        raise UploadError(f'Размер файла должен быть от 0 до {settings.SHARE_FILE_MAX_SIZE} байт')
+    upload = Upload.objects.create(filename=os.path.basename(filename)[:255] or 'file', size=size)
+    os.makedirs(parts_dir(), exist_ok=True)
+    open(part_path(upload), 'ab').close()
+    return upload
+
+
+@contextmanager
+def locked_part(upload: Upload):
+    # одну загрузку в каждый момент пишет один запрос (повторная отправка после обрыва связи
+    # может прийти, пока старый запрос еще не закрыт)
+    try:
+        part = open(part_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise UploadError('Загрузка не найдена')
+    with part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict(upload_offset(upload))
+        yield part
+
+
+def write_chunk(upload: Upload, offset: int, stream, length: int) -> int:
+    # stream читается блоками: часть не держится в памяти целиком
+    if length > settings.SHARE_FILE_CHUNK_SIZE:
+        raise UploadError(f'Часть больше {settings.SHARE_FILE_CHUNK_SIZE} байт')
+    with locked_part(upload) as part:
+        current = os.fstat(part.fileno()).st_size
+        if offset != current:
+            raise UploadConflict(current)
+        if offset + length > upload.size:
+            raise UploadError('Части больше размера файла')
+        part.seek(offset)
+        remaining = length
+        while remaining:
+            block = stream.read(min(remaining, 64 * 1024))
+            if not block:
+                break
+            part.write(block)
+            remaining -= len(block)
+        part.flush()
+        os.fsync(part.fileno())
+        return part.tell()
+
+
+def complete_upload(upload: Upload) -> File:
+    # файл появляется в хранилище целиком (rename) вместе с записью File, запись Upload удаляется
+    with locked_part(upload) as part:
+        if os.fstat(part.fileno()).st_size != upload.size:
+            raise UploadConflict(os.fstat(part.fileno()).st_size)
+        with transaction.atomic(), open(part.name, 'rb') as content:
+            file = File(name=upload.filename)
+            file.file.save(upload.filename, PartFile(content, name=upload.filename), save=True)
+            upload.delete()
+    return file
+
+
+def discard_upload(upload: Upload) -> None:
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
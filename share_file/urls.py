@@ -8,5 +8,8 @@ urlpatterns = [
     path('', views.FileList.as_view(), name='file_list'),
     path('file-add/', views.FileFieldFormView.as_view(), name='file_add'),
     path('file-delete/<int:pk>/', views.file_delete, name='file_delete'),
+    path('file/<int:pk>/', views.FileDownload.as_view(), name='file_download'),
+    path('upload/', views.upload_start, name='upload_start'),
+    path('upload/<uuid:pk>/', views.upload_chunk, name='upload_chunk'),
 
 ]
@@ -1,9 +1,17 @@
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.shortcuts import render, redirect
-from django.urls import reverse_lazy
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, HttpResponse
+from django.shortcuts import render, redirect, aget_object_or_404
+from django.urls import reverse_lazy, reverse
+from django.views import View
+from django.views.decorators.http import require_POST, require_http_methods
 from django.views.generic import ListView, CreateView
 
-from share_file.models import File
+from mixins import AsyncLoginRequiredMixin
+from share_file import uploads
+from share_file.models import File, Upload
+from voditel.downloads import protected_file_response
 
 from django.views.generic.edit import FormView
 from .forms import FileFieldForm
@@ -13,13 +21,16 @@ def home(request):
     return render(request, 'share_file/file_list.html', {'title': 'dfkdj'})
 
 
-class FileList(LoginRequiredMixin, ListView):
+class FileList(AsyncLoginRequiredMixin, ListView):
     model = File
     template_name = "share_file/file_list.html"
     extra_context = {'title': 'Файлы'}
     context_object_name = 'files'
     paginate_by = 7
 
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(super().get)(request, *args, **kwargs)
+
 
 # class FileAdd(LoginRequiredMixin, CreateView):
 #     model = File
@@ -39,11 +50,21 @@ class FileList(LoginRequiredMixin, ListView):
 
 
 
-class FileFieldFormView(FormView):
+class FileFieldFormView(AsyncLoginRequiredMixin, FormView):
     form_class = FileFieldForm
     template_name = "share_file/file_add.html"  # Replace with your template.
     success_url = reverse_lazy("share_file:file_add") # Replace with your URL or reverse().
 
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(super().get)(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        # запись файлов на диск - в потоке, цикл событий не ждет
+        return await sync_to_async(super().post)(request, *args, **kwargs)
+
+    async def put(self, *args, **kwargs):
+        return await self.post(*args, **kwargs)
+
     def form_valid(self, form):
         files = form.cleaned_data["file_field"]
         for f in files:
@@ -55,10 +76,64 @@ class FileFieldFormView(FormView):
         context =  super().get_context_data(**kwargs)
         context['title'] = 'Файлы'
         context['files'] = File.objects.all()
+        context['upload_url'] = reverse('share_file:upload_start')
+        context['chunk_size'] = settings.SHARE_FILE_CHUNK_SIZE
         return context
 
-def file_delete(request, pk):
-    file = File.objects.get(pk=pk)
-    file.file.delete()
-    file.delete()
-    return redirect('share_file:file_add')
\ No newline at end of file
+@login_required
+async def file_delete(request, pk):
+    file = await aget_object_or_404(File, pk=pk)
+    # blob удаляется с последней ссылкой (share_file.signals)
+    await file.adelete()
+    return redirect('share_file:file_add')
+
+
+class FileDownload(AsyncLoginRequiredMixin, View):
+    async def get(self, request, *args, **kwargs):
+        file = await aget_object_or_404(File, pk=kwargs.get('pk'))
+        return await sync_to_async(protected_file_response)(request, file.file, filename=str(file))
+
+
+def upload_state(upload: Upload, offset: int) -> dict:
+    return {'id': str(upload.pk), 'offset': offset, 'size': upload.size,
+            'url': reverse('share_file:upload_chunk', kwargs={'pk': upload.pk})}
+
+
+# загрузка по частям (share_file.uploads): форма file_add отправляет файлы через эти адреса,
+# запись частей на диск - в потоках вне цикла событий; загружать могут только вошедшие пользователи
+
+@login_required
+@require_POST
+async def upload_start(request):
+    try:
+        upload = await sync_to_async(uploads.start_upload)(request.POST.get('filename', ''),
+                                                           int(request.POST.get('size', -1)))
+    except (ValueError, uploads.UploadError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(upload_state(upload, 0), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'POST', 'DELETE'])
+async def upload_chunk(request, pk):
+    upload = await aget_object_or_404(Upload, pk=pk)
+    if request.method == 'GET':
+        # докачка после обрыва: клиент продолжает с этого смещения
+        return JsonResponse(upload_state(upload, uploads.upload_offset(upload)))
+    if request.method == 'DELETE':
+        await sync_to_async(uploads.discard_upload)(upload)
+        return HttpResponse(status=204)
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.headers.get('Content-Length') or 0)
+        offset = await sync_to_async(uploads.write_chunk, thread_sensitive=False)(upload, offset, request, length)
+        state = upload_state(upload, offset)
+        if offset == upload.size:
+            file = await sync_to_async(uploads.complete_upload)(upload)
+            state['file'] = file.pk
+    except uploads.UploadConflict as e:
+        return JsonResponse({**upload_state(upload, e.offset), 'error': str(e)}, status=409)
+    except (ValueError, uploads.UploadError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(state)
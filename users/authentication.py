@@ -1,24 +1,134 @@
-from django.contrib.auth import get_user_model
-from django.contrib.auth.backends import BaseBackend
+import time
+import uuid
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model, get_user, SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db import router
+from django.db.models import Case, When, Value, Q
+from django.db.models.functions import Lower
+from django.utils.functional import SimpleLazyObject
 
-class EmailAuthBackend(BaseBackend):
+SNAPSHOT_SESSION_KEY = '_auth_user_snapshot'
+
+
+class UsernameOrEmailBackend(ModelBackend):
+    # вход по логину или по email одним запросом; пароль хешируется ровно один раз,
+    # в том числе когда пользователя нет (как в ModelBackend), чтобы время ответа его не выдавало
     def authenticate(self, request, username=None, password=None, **kwargs):
         user_model = get_user_model()
-        try:
-            user  = user_model.objects.get(email=username)
-            if user.check_password(password):
-                return user
+        if username is None:
+            username = kwargs.get(user_model.USERNAME_FIELD)
+        if username is None or password is None:
             return None
-        except (user_model.DoesNotExist, user_model.MultipleObjectsReturned):
+        # lower(email) совпадает с выражением индекса user_email_ci_unique; логин важнее email
+        user = user_model._default_manager.alias(email_lower=Lower('email')). \
+            filter(Q(username=username) | Q(email_lower=username.lower())). \
+            order_by(Case(When(username=username, then=Value(0)), default=Value(1))).first()
+        if user is None:
+            user_model().set_password(password)
             return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+
+def snapshot_cache():
+    alias = settings.USER_SNAPSHOT_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def snapshot_version_key(user_id) -> str:
+    return f'users:snapshot-version:{user_id}'
+
+
+def bump_snapshot_version(user_id) -> None:
+    # снимки пользователя во всех сессиях устаревают (см. users.signals)
+    cache = snapshot_cache()
+    if cache is not None:
+        cache.set(snapshot_version_key(user_id), uuid.uuid4().hex, None)
+
+
+def snapshot_version(user_id):
+    # версия появляется вместе с первым снимком; пропавшая из кеша (вытеснена, кеш перезапущен)
+    # версия делает все старые снимки негодными
+    cache = snapshot_cache()
+    cache.add(snapshot_version_key(user_id), uuid.uuid4().hex, None)
+    return cache.get(snapshot_version_key(user_id))
+
+
+def forget_user_snapshot(request) -> None:
+    request.session.pop(SNAPSHOT_SESSION_KEY, None)
+
+
+def make_snapshot(user, session) -> dict:
+    # поля пользователя без пароля: пароль в сессии не хранится, в загруженном из снимка
+    # пользователе он отложенное поле (save() пишет только загруженные поля)
+    fields = [field for field in user._meta.concrete_fields if field.attname != 'password']
+    return {
+        'pk': str(user.pk),
+        'hash': session.get(HASH_SESSION_KEY),
+        'version': snapshot_version(user.pk),
+        'created': time.time(),
+        'fields': {field.attname: None if field.value_from_object(user) is None else field.value_to_string(user)
+                   for field in fields},
+    }
+
+
+def load_snapshot(snapshot: dict):
+    user_model = get_user_model()
+    fields = {field.attname: field for field in user_model._meta.concrete_fields}
+    names = list(snapshot['fields'])
+    values = [None if value is None else fields[name].to_python(value)
+              for name, value in snapshot['fields'].items()]
+    return user_model.from_db(router.db_for_read(user_model), names, values)
+
+
+def snapshot_is_fresh(snapshot, session) -> bool:
+    # снимок годен, пока в сессии тот же пользователь с тем же хешем пароля, не истек
+    # USER_SNAPSHOT_TTL и версия в кеше не сменилась (изменение профиля или пароля)
+    if snapshot is None or snapshot['pk'] != str(session.get(SESSION_KEY)):
+        return False
+    if snapshot['hash'] != session.get(HASH_SESSION_KEY):
+        return False
+    if time.time() - snapshot['created'] > settings.USER_SNAPSHOT_TTL:
+        return False
+    version = snapshot_cache().get(snapshot_version_key(snapshot['pk']))
+    return version is not None and version == snapshot['version']
+
+
+def get_snapshot_user(request):
+    if not hasattr(request, '_cached_user'):
+        session = request.session
+        snapshot = session.get(SNAPSHOT_SESSION_KEY)
+        if SESSION_KEY not in session:
+            user = AnonymousUser()
+        elif snapshot_cache() is None:
+            user = get_user(request)
+        elif snapshot_is_fresh(snapshot, session):
+            user = load_snapshot(snapshot)
+        else:
+            # полная проверка django: пользователь из базы, хеш пароля, backend
+            user = get_user(request)
+            if user.is_authenticated:
+                session[SNAPSHOT_SESSION_KEY] = make_snapshot(user, session)
+            else:
+                forget_user_snapshot(request)
+        request._cached_user = user
+    return request._cached_user
 
-    def get_user(self, user_id):
-        user_model = get_user_model()
-        try:
-            return user_model.objects.get(pk=user_id)
-        except user_model.DoesNotExist:
-            return None
 
+async def aget_snapshot_user(request):
+    return await sync_to_async(get_snapshot_user)(request)
 
 
+class SnapshotAuthenticationMiddleware(AuthenticationMiddleware):
+    # request.user из снимка в сессии, без запроса к таблице пользователей на каждый запрос
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_snapshot_user(request))
+        request.auser = lambda: aget_snapshot_user(request)
@@ -52,7 +52,7 @@ class RegisterUserForm(UserCreationForm):
 
     def clean_email(self):
         email = self.cleaned_data.get('email')
-        if get_user_model().objects.filter(email=email).exists():
+        if email and get_user_model().objects.filter(email__iexact=email).exists():
             raise forms.ValidationError("Такой e-mail уже существует")
         return email
 
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:41
+
+from collections import defaultdict
+
+import django.db.models.functions.text
+from django.core.management.base import CommandError
+from django.db import migrations, models
+
+
+def check_duplicate_emails(apps, schema_editor):
+    # повторяющиеся email (без учета регистра) не исправляются молча: миграция останавливается
+    # со списком учетных записей, какую почту оставить - решает администратор
+    User = apps.get_model('users', 'User')
+    accounts = defaultdict(list)
+    for user in User.objects.exclude(email='').order_by('date_joined', 'pk'):
+        accounts[user.email.lower()].append(user)
+    duplicates = [f'  {email}: ' + ', '.join(f'{user.username} (id={user.pk})' for user in users)
+                  for email, users in accounts.items() if len(users) > 1]
+    if duplicates:
+        raise CommandError('Один email у нескольких пользователей, исправьте email у лишних учетных записей '
+                           'и повторите migrate:\n' + '\n'.join(duplicates))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), condition=models.Q(('email', ''), _negated=True), name='user_email_ci_unique', violation_error_message='Такой e-mail уже существует'),
+        ),
+    ]
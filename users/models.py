@@ -3,6 +3,7 @@ import os
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 
 
 def user_directory_path(instance, filename):
@@ -20,5 +21,12 @@ class User(AbstractUser):
     photo = models.ImageField(upload_to=user_directory_path, blank=True, null=True, verbose_name='Фотография')
     date_birth = models.DateField(blank=True, null=True, verbose_name='Дата рождения')
 
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # вход по email (users.authentication): один адрес - один пользователь без учета регистра
+            models.UniqueConstraint(Lower('email'), condition=~models.Q(email=''), name='user_email_ci_unique',
+                                    violation_error_message='Такой e-mail уже существует'),
+        ]
+
 
 
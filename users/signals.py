@@ -0,0 +1,13 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from users.authentication import bump_snapshot_version
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_snapshots(sender, instance, raw=False, **kwargs):
+    # профиль, пароль, права или активность изменились - снимки в сессиях перечитываются из базы
+    if not raw:
+        bump_snapshot_version(instance.pk)
@@ -1,3 +1,138 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import authenticate, get_user_model, SESSION_KEY
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import connection, IntegrityError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from users.authentication import SNAPSHOT_SESSION_KEY, snapshot_version_key
+from users.forms import RegisterUserForm
+
+
+class UsernameOrEmailBackendTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='driver', email='Driver@Example.com',
+                                                        password='pass')
+
+    def test_login_by_username_or_email(self):
+        self.assertEqual(authenticate(username='driver', password='pass'), self.user)
+        self.assertEqual(authenticate(username='driver@example.COM', password='pass'), self.user)
+        self.assertIsNone(authenticate(username='driver', password='wrong'))
+
+    def test_username_wins_over_email(self):
+        other = get_user_model().objects.create_user(username='driver@example.com', password='other')
+        self.assertEqual(authenticate(username='driver@example.com', password='other'), other)
+        self.assertIsNone(authenticate(username='driver@example.com', password='pass'))
+
+    def test_password_hashed_once(self):
+        user_model = get_user_model()
+        with mock.patch.object(user_model, 'set_password', autospec=True) as set_password, \
+                mock.patch.object(user_model, 'check_password', autospec=True, return_value=False) as check_password:
+            self.assertIsNone(authenticate(username='nobody', password='pass'))
+            self.assertIsNone(authenticate(username='driver', password='wrong'))
+        self.assertEqual(set_password.call_count, 1)
+        self.assertEqual(check_password.call_count, 1)
+
+    def test_email_unique_ignoring_case(self):
+        form = RegisterUserForm(data={'email': 'DRIVER@example.com'})
+        self.assertIn('email', form.errors)
+        with self.assertRaises(IntegrityError):
+            get_user_model().objects.create_user(username='copy', email='driver@EXAMPLE.com', password='pass')
+
+    def test_blank_email_not_unique(self):
+        get_user_model().objects.create_user(username='first', password='pass')
+        get_user_model().objects.create_user(username='second', password='pass')
+
+
+class UserSnapshotTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='driver', email='driver@example.com',
+                                                        password='pass', first_name='Иван')
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('users:profile'))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries if 'users_user' in query['sql']]
+
+    def test_user_loaded_from_session_snapshot(self):
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.client.session[SNAPSHOT_SESSION_KEY]['fields']['first_name'], 'Иван')
+        self.assertNotIn('password', self.client.session[SNAPSHOT_SESSION_KEY]['fields'])
+        self.assertEqual(self.user_queries(), [])
+
+    def test_user_change_invalidates_snapshot(self):
+        self.client.force_login(self.user)
+        self.user_queries()
+        self.user.first_name = 'Петр'
+        self.user.save()
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.client.session[SNAPSHOT_SESSION_KEY]['fields']['first_name'], 'Петр')
+
+    def test_password_change_elsewhere_logs_out(self):
+        self.client.force_login(self.user)
+        self.user_queries()
+        self.user.set_password('new')
+        self.user.save()
+        response = self.client.get(reverse('users:profile'))
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(SESSION_KEY, self.client.session)
+
+    def test_lost_version_is_not_fresh(self):
+        # версия вытеснена из кеша или кеш перезапущен: снимок перечитывается из базы
+        self.client.force_login(self.user)
+        self.user_queries()
+        caches['default'].delete(snapshot_version_key(self.user.pk))
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.user_queries(), [])
+
+    @override_settings(USER_SNAPSHOT_CACHE_ALIAS=None)
+    def test_without_shared_cache_user_read_every_request(self):
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertNotIn(SNAPSHOT_SESSION_KEY, self.client.session)
+        self.user.set_password('new')
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('users:profile')).status_code, 302)
+
+    def test_snapshot_user_saves_without_password(self):
+        self.client.force_login(self.user)
+        self.user_queries()
+        response = self.client.post(reverse('users:profile'), {
+            'first_name': 'Петр', 'last_name': 'Петров',
+            'date_birth_day': 1, 'date_birth_month': 1, 'date_birth_year': 1980})
+        self.assertEqual(response.status_code, 302)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_name, 'Петров')
+        self.assertTrue(self.user.check_password('pass'))
+
+
+class UserPhotoTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = get_user_model().objects.create_user(username='driver', password='pass')
+
+    def test_own_photo_only_through_view(self):
+        url = reverse('users:photo')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.user.photo.save('me.png', ContentFile(b'png'))
+        with override_settings(MEDIA_ACCEL_REDIRECT=True):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/users/driver/me.png')
+        self.assertEqual(response['Content-Type'], 'image/png')
@@ -15,6 +15,7 @@ urlpatterns = [
 
     path('register/', views.RegisterUser.as_view(), name='register'),
     path('profile/', views.ProfileUser.as_view(), name='profile'),
+    path('photo/', views.UserPhoto.as_view(), name='photo'),
 
     path('password-reset/',
          views.UserPasswordReset.as_view(
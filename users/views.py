@@ -4,9 +4,13 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView, PasswordChangeView, LogoutView, PasswordResetView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.urls import reverse_lazy
+from django.http import Http404
+from django.views import View
 from django.views.generic import CreateView, UpdateView
 
 from mixins import ErrorMessageMixin
+from users.authentication import forget_user_snapshot
+from voditel.downloads import protected_file_response
 from users.forms import LoginUserForm, RegisterUserForm, ProfileUserForm, UserPasswordChangeForm, UserPasswordResetForm
 
 
@@ -45,10 +49,22 @@ class ProfileUser(SuccessMessageMixin, ErrorMessageMixin, LoginRequiredMixin, Up
     def get_success_url(self):
         return reverse_lazy("users:profile")
 
+    def form_valid(self, form):
+        forget_user_snapshot(self.request)
+        return super().form_valid(form)
+
     def get_object(self, queryset=None):
         return self.request.user
 
 
+class UserPhoto(LoginRequiredMixin, View):
+    # фотография видна только самому пользователю
+    def get(self, request, *args, **kwargs):
+        if not request.user.photo:
+            raise Http404
+        return protected_file_response(request, request.user.photo)
+
+
 class UserPasswordChange(SuccessMessageMixin, ErrorMessageMixin, PasswordChangeView):
     form_class = UserPasswordChangeForm
     success_url = reverse_lazy("users:password_change_done")
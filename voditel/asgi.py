@@ -11,6 +11,13 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'voditel.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'voditel.settings.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings
+
+if settings.REPORT_RENDER_POOL:
+    from cards.rendering import render_pool
+
+    render_pool().start()
@@ -0,0 +1,62 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+# ключи кеша приложения: "<область>:<версия области>:<части ключа>"; invalidate(область) меняет
+# версию, и все ключи области сразу устаревают (старые записи вытесняются по TIMEOUT)
+
+
+def get_cache():
+    return caches[settings.APP_CACHE_ALIAS]
+
+
+def version_key(namespace: str) -> str:
+    return f'{namespace}:version'
+
+
+def namespace_version(namespace: str) -> int:
+    cache = get_cache()
+    version = cache.get(version_key(namespace))
+    if version is None:
+        cache.add(version_key(namespace), 1, None)
+        version = cache.get(version_key(namespace), 1)
+    return version
+
+
+def make_key(namespace: str, *parts) -> str:
+    key = ':'.join(str(part) for part in parts)
+    # memcached/redis не любят длинные ключи и пробелы
+    if len(key) > 100 or ' ' in key:
+        key = hashlib.sha256(key.encode()).hexdigest()
+    return f'{namespace}:{namespace_version(namespace)}:{key}'
+
+
+def get_or_set(namespace: str, *parts, default, timeout=None):
+    # default - функция, вызывается только при промахе
+    return get_cache().get_or_set(make_key(namespace, *parts), default,
+                                  settings.APP_CACHE_TIMEOUT if timeout is None else timeout)
+
+
+def invalidate(namespace: str) -> None:
+    cache = get_cache()
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        cache.set(version_key(namespace), 2, None)
+
+
+def cached(namespace: str, timeout=None):
+    # кеширует результат функции по ее позиционным и именованным аргументам
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parts = list(args) + [f'{name}={value}' for name, value in sorted(kwargs.items())]
+            return get_or_set(namespace, func.__qualname__, *parts, default=lambda: func(*args, **kwargs),
+                              timeout=timeout)
+
+        wrapper.invalidate = lambda: invalidate(namespace)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,96 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date
+
+from voditel.streaming import asgi_streaming
+
+# файлы из MEDIA_ROOT отдаются только через представления с проверкой прав: с MEDIA_ACCEL_REDIRECT
+# django отвечает заголовком X-Accel-Redirect, и байты (sendfile, Range) отдает nginx из internal
+# location MEDIA_ACCEL_PREFIX; без него (разработка) - FileResponse с поддержкой Range
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    # часть файла для FileResponse: читает не больше length байт начиная с start
+    def __init__(self, file, start: int, length: int):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def parse_range(header: str, size: int):
+    # один диапазон "bytes=start-end" / "bytes=start-" / "bytes=-suffix"; None - отдать файл целиком,
+    # () - диапазон за пределами файла
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return ()
+    return start, end
+
+
+def accel_response(name: str, filename: str, as_attachment: bool) -> HttpResponse:
+    response = HttpResponse(content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(name)
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    return response
+
+
+def file_response(request, path: str, filename: str, as_attachment: bool) -> HttpResponse:
+    stat = os.stat(path)
+    response = get_conditional_response(request, last_modified=int(stat.st_mtime))
+    if response is not None:
+        return response
+
+    range_header = request.headers.get('Range')
+    byte_range = parse_range(range_header, stat.st_size) if range_header else None
+    if byte_range == ():
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, as_attachment=as_attachment, filename=filename)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangeFile(file, start, end - start + 1), as_attachment=as_attachment,
+                                filename=filename, status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return asgi_streaming(request, response)
+
+
+def protected_file_response(request, field_file, filename: str = None, as_attachment: bool = False):
+    # field_file - FieldFile модели (File.file, User.photo), права проверяет вызывающее представление
+    filename = filename or os.path.basename(field_file.name)
+    if settings.MEDIA_ACCEL_REDIRECT:
+        response = accel_response(field_file.name, filename, as_attachment)
+    else:
+        response = file_response(request, field_file.path, filename, as_attachment)
+    patch_cache_control(response, private=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
@@ -0,0 +1,167 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+logger = logging.getLogger('voditel.profiling')
+
+current_stats = contextvars.ContextVar('profiling_stats', default=None)
+
+
+def normalize_sql(sql: str) -> str:
+    # одинаковые запросы с разными параметрами сводятся к одному виду
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\((?:\s*(?:\?|%s)\s*,)+\s*(?:\?|%s)\s*\)', '(...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = Counter()
+        self.sql_time = 0.0
+        self.timings = Counter()
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries[normalize_sql(sql)] += 1
+
+    def duplicates(self, threshold: int) -> list:
+        return [{'sql': sql, 'count': count} for sql, count in self.queries.most_common() if count >= threshold]
+
+
+def record_current_query(execute, sql, params, many, context):
+    # execute_wrapper каждого соединения: запрос пишется в статистику текущего профилируемого запроса;
+    # под asgi sql выполняется в потоках sync_to_async, статистика приходит туда через contextvars
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.record_query(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_current_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_current_query)
+
+
+@contextmanager
+def timer(kind: str):
+    # замер участка кода (шаблоны, weasyprint) в рамках текущего профилируемого запроса
+    stats = current_stats.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.timings[kind] += time.perf_counter() - started
+
+
+def profile_log_files() -> list:
+    path = str(settings.PROFILING_LOG_FILE)
+    files = [f'{path}.{i}' for i in range(settings.PROFILING_LOG_BACKUP_COUNT, 0, -1)] + [path]
+    return [f for f in files if os.path.exists(f)]
+
+
+class ProfilingMiddleware:
+    # число и время sql запросов, время шаблонов и weasyprint на каждый выбранный запрос;
+    # записи пишутся json строками в PROFILING_LOG_FILE, сводка - команда profile_summary
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # под asgi цепочка асинхронная: замер не должен переключать ее в sync_to_async
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        path = os.path.abspath(settings.PROFILING_LOG_FILE)
+        if not any(getattr(handler, 'baseFilename', None) == path for handler in logger.handlers):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=settings.PROFILING_LOG_MAX_BYTES,
+                                          backupCount=settings.PROFILING_LOG_BACKUP_COUNT, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        connection_created.connect(install_query_recorder, dispatch_uid='voditel.profiling')
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(None, connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.log(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.log(request, response, stats)
+        return response
+
+    def log(self, request, response, stats: RequestStats) -> None:
+        total = time.perf_counter() - stats.started
+        match = request.resolver_match
+        duplicates = stats.duplicates(settings.PROFILING_DUPLICATE_THRESHOLD)
+        record = {
+            'time': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'url_name': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'queries': sum(stats.queries.values()),
+            'sql_ms': round(stats.sql_time * 1000, 2),
+            'template_ms': round(stats.timings['template'] * 1000, 2),
+            'pdf_ms': round(stats.timings['pdf'] * 1000, 2),
+            'duplicates': duplicates,
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+    def process_template_response(self, request, response):
+        # TemplateResponse рендерится после view, оборачиваем render для замера
+        render = response.render
+
+        def timed_render():
+            with timer('template'):
+                return render()
+
+        response.render = timed_render
+        return response
@@ -4,23 +4,79 @@ from .settings import *
 
 DEBUG = int(os.environ.get("DEBUG", default=0))
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db/db.sqlite3',
+# DB_ENGINE=postgresql - PostgreSQL (нужен psycopg, см. requirements.txt), иначе sqlite в db/
+# перенос данных из sqlite: ./manage.py copy_sqlite_database db/db.sqlite3
+if os.environ.get("DB_ENGINE", default="sqlite") == "postgresql":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', 5432),
+            'USER': os.getenv('POSTGRES_USER', 'daboggg'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
+            'NAME': os.getenv('POSTGRES_DB', "db01"),
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
-}
-
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
-#         'PORT': os.getenv('POSTGRES_PORT', 5432),
-#         'USER': os.getenv('POSTGRES_USER', 'daboggg'),
-#         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
-#         'NAME': os.getenv('POSTGRES_DB', "db01")
-#     }
-# }
+    if int(os.environ.get("DB_POOL", default=0)):
+        # пул соединений psycopg на воркер, постоянные соединения django при этом выключены
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get("DB_POOL_MIN_SIZE", default=2)),
+                'max_size': int(os.environ.get("DB_POOL_MAX_SIZE", default=10)),
+                'timeout': int(os.environ.get("DB_POOL_TIMEOUT", default=10)),
+            },
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get("DB_CONN_MAX_AGE", default=60))
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db/db.sqlite3',
+            'OPTIONS': SQLITE_OPTIONS,
+        }
+    }
+
+# CACHE_BACKEND=file - кеш в файлах cache/django, redis - CACHE_LOCATION (нужен redis, см. requirements.txt),
+# иначе кеш в памяти каждого процесса; общий кеш делят и справочники (REFERENCE_CACHE_ALIAS), и снимки
+# пользователей (USER_SNAPSHOT_CACHE_ALIAS): без него смена пароля в одном воркере не дошла бы до остальных
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", default="locmem")
+if CACHE_BACKEND == "redis":
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get("CACHE_LOCATION", default="redis://redis:6379/0"),
+            'KEY_PREFIX': 'voditel',
+            'TIMEOUT': 300,
+        }
+    }
+elif CACHE_BACKEND == "file":
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get("CACHE_LOCATION", default=BASE_DIR / 'cache/django'),
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+if CACHE_BACKEND != "locmem":
+    REFERENCE_CACHE_ALIAS = 'default'
+else:
+    USER_SNAPSHOT_CACHE_ALIAS = None
+    # сессия из кеша другого процесса может быть старой (выход, сообщения): только база
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+MEDIA_ACCEL_REDIRECT = int(os.environ.get("MEDIA_ACCEL_REDIRECT", default=1))
+
+PROFILING_ENABLED = int(os.environ.get("PROFILING_ENABLED", default=0))
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", default=0.1))
+
+REPORT_RENDER_WORKERS = int(os.environ.get("REPORT_RENDER_WORKERS", default=2))
+REPORT_RENDER_POOL = int(os.environ.get("REPORT_RENDER_POOL", default=1))
+REPORT_RENDER_PROCESSES = int(os.environ.get("REPORT_RENDER_PROCESSES", default=2))
+REPORT_RENDER_TIMEOUT = int(os.environ.get("REPORT_RENDER_TIMEOUT", default=60))
 
 ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", default=[]).split(" ")
 
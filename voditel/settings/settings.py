@@ -43,13 +43,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'voditel.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.authentication.SnapshotAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'cards.rendering.RenderBusyMiddleware',
 
 ]
 
@@ -78,13 +80,49 @@ WSGI_APPLICATION = 'voditel.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# sqlite под несколькими воркерами: WAL (читатели не ждут писателя), ожидание блокировки
+# вместо "database is locked" и запись с BEGIN IMMEDIATE, чтобы транзакция не падала
+# при попытке повысить блокировку с чтения до записи
+SQLITE_OPTIONS = {
+    'init_command': 'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA busy_timeout=5000;'
+                    'PRAGMA foreign_keys=ON;'
+                    'PRAGMA cache_size=-20000;',
+    'timeout': 5,
+    'transaction_mode': 'IMMEDIATE',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# кеш процесса; в prod_settings CACHE_BACKEND выбирает общий для воркеров file или redis
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'voditel',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+# сессии читаются из кеша, в базу только запись и промах кеша; сообщения хранятся в сессии
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+
+# кеш приложения (voditel.caching)
+APP_CACHE_ALIAS = 'default'
+APP_CACHE_TIMEOUT = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -122,6 +160,46 @@ STATIC_ROOT = 'static'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = 'media'
 
+# MEDIA_ROOT не раздается напрямую: файлы отдают представления с проверкой прав (voditel.downloads),
+# с MEDIA_ACCEL_REDIRECT - через internal location nginx MEDIA_ACCEL_PREFIX
+MEDIA_ACCEL_REDIRECT = False
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 3600
+
+# загрузка файлов share_file по частям (share_file.uploads): части - в MEDIA_ROOT/SHARE_FILE_PARTS_DIR
+SHARE_FILE_PARTS_DIR = '.uploads'
+SHARE_FILE_CHUNK_SIZE = 5 * 1024 * 1024
+SHARE_FILE_MAX_SIZE = 4 * 1024 * 1024 * 1024
+# незавершенные загрузки старше этого удаляет ./manage.py clear_uploads
+SHARE_FILE_UPLOAD_EXPIRE_HOURS = 24
+
+# готовые pdf отчеты (cards.reports.ReportCache)
+REPORT_CACHE_DIR = BASE_DIR / 'cache/reports'
+REPORT_CACHE_MAX_SIZE = 200 * 1024 * 1024
+# сколько pdf рендерится одновременно в asgi режиме (cards.reports.aget_report_pdf)
+REPORT_RENDER_WORKERS = 2
+# pdf рендерятся в отдельных процессах с прогретым weasyprint (cards.rendering); без пула - в потоке запроса
+REPORT_RENDER_POOL = False
+REPORT_RENDER_PROCESSES = 2
+# сколько рендеров может ждать свободный процесс, остальные получают 503
+REPORT_RENDER_QUEUE = 8
+REPORT_RENDER_TIMEOUT = 60
+REPORT_RENDER_RETRY_AFTER = 10
+
+# справочники норм и автомобилей в памяти процесса (cards.references), сбрасываются сигналами;
+# REFERENCE_CACHE_ALIAS - кеш из CACHES, общий для всех процессов (None - только память процесса)
+REFERENCE_CACHE_TTL = 300
+REFERENCE_CACHE_ALIAS = None
+
+# профилирование запросов (voditel.profiling), сводка - ./manage.py profile_summary
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 1.0
+PROFILING_LOG_FILE = BASE_DIR / 'logs/profile.log'
+PROFILING_LOG_MAX_BYTES = 10 * 1024 * 1024
+PROFILING_LOG_BACKUP_COUNT = 5
+# одинаковый (с точностью до параметров) запрос столько раз за запрос считается N+1
+PROFILING_DUPLICATE_THRESHOLD = 3
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -135,10 +213,15 @@ LOGOUT_REDIRECT_URL = 'home'
 LOGIN_URL = 'users:login'
 
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
-    'users.authentication.EmailAuthBackend',
+    'users.authentication.UsernameOrEmailBackend',
 ]
 
+# снимок пользователя в сессии (users.authentication): сколько секунд он живет без проверки по базе
+# и в каком кеше хранятся версии снимков, которые сбрасываются при изменении пользователя; кеш должен
+# быть общим для всех процессов (None - снимки выключены, пользователь читается из базы)
+USER_SNAPSHOT_TTL = 300
+USER_SNAPSHOT_CACHE_ALIAS = 'default'
+
 # DATE_INPUT_FORMATS = ["%d.%m.%Y"]
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
@@ -0,0 +1,30 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+# под asgi django читает синхронный streaming_content целиком через sync_to_async(list) и держит
+# весь ответ в памяти; asgi_streaming() отдает его асинхронным итератором, который берет части
+# порциями в потоке синхронного кода (там же, где открыт курсор .iterator() или файл)
+
+STREAM_BATCH = 64
+
+
+async def aiterate(iterator, batch_size: int = STREAM_BATCH):
+    iterator = iter(iterator)
+    next_batch = sync_to_async(lambda: list(islice(iterator, batch_size)))
+    try:
+        while batch := await next_batch():
+            for part in batch:
+                yield part
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+def asgi_streaming(request, response):
+    # под wsgi ответ не меняется
+    if isinstance(request, ASGIRequest) and response.streaming and not response.is_async:
+        response.streaming_content = aiterate(response.streaming_content)
+    return response